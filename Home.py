@@ -1,12 +1,16 @@
 import streamlit as st
 from streamlit_extras.switch_page_button import switch_page
 
+import metrics
+
 st.set_page_config(
     page_title="Flormemoru",
     page_icon=":blossom:",
     layout="centered"
 )
 
+rerun_timer = metrics.timer("page_rerun_seconds", page="Home")
+
 
 st.title("Welcome to Flormemoru")
 
@@ -16,3 +20,5 @@ st.image("./flormemoru_logo.jpg")
 
 if st.button("Begin", use_container_width=True, type="primary"):
     switch_page("Multichoice")
+
+rerun_timer.stop()
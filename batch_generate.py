@@ -0,0 +1,177 @@
+"""
+Generate flowers and their images in bulk, without the app, e.g. for an unattended library build on a server:
+
+    OPENAI_API_KEY=sk-... python batch_generate.py 5000 --job overnight
+
+Names are generated in parallel requests (chat.generate_json_items), then images on a pool of workers
+(chat.ImagePipeline), and finished images are added to the catalogue in batches (ingest.ingest_images), under the same
+names as images added from the Generate page.
+
+Progress is checkpointed in the job's directory, .cache/jobs/<job>: flowers.jsonl has every flower named so far, and
+images.jsonl every flower whose image has been added to the catalogue (or rejected by it, e.g. as a duplicate). Running
+the same command again resumes the job, skipping those; flowers whose image request failed are tried again. Requests
+that completed before an interruption are answered from the response cache, so repeating them costs nothing.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from chat import CompletionParameters, ImagePipeline, generate_json_items, DEFAULT_IMAGE_CONCURRENCY, DEFAULT_MAX_TOKENS, DEFAULT_SHARD_CONCURRENCY
+from flowers import EXAMPLE_FLOWER, flower_image_prompt, flower_keys, flower_names_shard_prompt
+from ingest import ingest_images
+
+JOBS_DIR = Path(".cache") / "jobs"
+
+# Generated images are added to the catalogue this many at a time
+INGEST_BATCH_SIZE = 50
+
+
+def read_jsonl(path: Path) -> List[Dict]:
+    """
+    The rows of a checkpoint file. A last line left incomplete by an interruption is cut off the file, so that rows
+    appended afterwards start on a line of their own; any other line that can't be read is skipped.
+    """
+    if not path.exists():
+        return []
+    data = path.read_bytes()
+    complete = data.rfind(b"\n") + 1
+    if complete < len(data):
+        with open(path, "r+b") as f:
+            f.truncate(complete)
+    rows = []
+    for line in data[:complete].decode("utf-8", errors="replace").splitlines():
+        try:
+            rows.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue
+    return rows
+
+
+def append_jsonl(path: Path, rows: List[Dict]):
+    with open(path, "a", encoding="utf-8") as f:
+        f.writelines(json.dumps(row) + "\n" for row in rows)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def generate_names(job_dir: Path, n: int, model: str, api_key: str, params: CompletionParameters, use_cache: bool = True,
+                   max_workers: int = DEFAULT_SHARD_CONCURRENCY) -> List[Dict[str, str]]:
+    """
+    The job's first `n` flowers, generating however many it doesn't have yet. Each request's flowers are checkpointed
+    as soon as it finishes.
+    """
+    path = job_dir / "flowers.jsonl"
+    flowers = read_jsonl(path)
+    if len(flowers) >= n:
+        return flowers[:n]
+
+    print(f"Generating {n - len(flowers)} flower names ({len(flowers)} already named)...")
+    flowers = generate_json_items(n, flower_names_shard_prompt, flower_keys, EXAMPLE_FLOWER, model, api_key, params, use_cache=use_cache,
+                                  max_workers=max_workers, on_progress=lambda count: print(f"  {count}/{n} flowers named", flush=True),
+                                  existing=flowers, on_items=lambda items: append_jsonl(path, items))
+    if len(flowers) < n:
+        print(f"Only {len(flowers)} different flowers could be named")
+    return flowers
+
+
+def generate_images(job_dir: Path, flowers: List[Dict[str, str]], api_key: str, model: str = "dall-e-3", shape: str = "square",
+                    quality: str = "standard", style: str = "vivid", directory: str = "images", max_workers: int = DEFAULT_IMAGE_CONCURRENCY,
+                    ingest_batch_size: int = INGEST_BATCH_SIZE, use_cache: bool = True) -> Tuple[int, int, int]:
+    """
+    Generate an image of every flower that doesn't have one yet, adding them to the catalogue in `directory` as they
+    finish. Returns the numbers of images added, rejected by the catalogue, and failed.
+    """
+    path = job_dir / "images.jsonl"
+    finished = {row["flower"] for row in read_jsonl(path)}
+    todo = [i for i in range(len(flowers)) if i not in finished]
+    if not todo:
+        return 0, 0, 0
+    print(f"Generating {len(todo)} images ({len(finished)} already done)...")
+
+    counts = {"added": 0, "rejected": 0, "failed": 0}
+    pending: List[Tuple[int, BytesIO]] = []
+
+    def ingest():
+        added = ingest_images([(image.getvalue(), flowers[i]) for i, image in pending], directory)
+        rows = []
+        for (i, _), (flower, image_path, error) in zip(pending, added):
+            if error is not None:
+                print(f"  Not added: {flower['common']} ({flower['latin']}): {error}")
+            counts["added" if error is None else "rejected"] += 1
+            rows.append({"flower": i, "latin": flower["latin"], "common": flower["common"], "path": image_path,
+                         "error": None if error is None else str(error)})
+        append_jsonl(path, rows)
+        pending.clear()
+        print(f"  {len(finished) + counts['added'] + counts['rejected']}/{len(flowers)} images done", flush=True)
+
+    def collect(results):
+        for index, image in results:
+            i = todo[index]
+            if isinstance(image, Exception):
+                counts["failed"] += 1
+                print(f"  Failed: {flowers[i]['common']} ({flowers[i]['latin']}): {image}")
+            else:
+                pending.append((i, image))
+        if len(pending) >= ingest_batch_size:
+            ingest()
+
+    try:
+        with ImagePipeline(api_key, model, shape, quality, style, max_workers=max_workers, max_pending=max_workers, use_cache=use_cache) as pipeline:
+            for i in todo:
+                pipeline.submit(flower_image_prompt(flowers[i]))
+                collect(pipeline.completed())
+            collect(pipeline.wait())
+    finally:
+        if pending:
+            ingest()  # Keep whatever finished, even if interrupted
+
+    return counts["added"], counts["rejected"], counts["failed"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("n", type=int, help="Number of flowers in the job")
+    parser.add_argument("--job", default="default", help="Name of the job, to resume it by")
+    parser.add_argument("--api-key", default=os.environ.get("OPENAI_API_KEY"), help="OpenAI API key (default: $OPENAI_API_KEY)")
+    parser.add_argument("--model", default="gpt-4", help="Chat model that names the flowers")
+    parser.add_argument("--temperature", type=float, default=1.0)
+    parser.add_argument("--top-p", type=float, default=1.0)
+    parser.add_argument("--max-tokens", type=int, default=DEFAULT_MAX_TOKENS, help="Per request; more flowers are asked for per request when higher")
+    parser.add_argument("--name-workers", type=int, default=DEFAULT_SHARD_CONCURRENCY, help="Naming requests in flight at once")
+    parser.add_argument("--image-model", default="dall-e-3", choices=["dall-e-2", "dall-e-3"])
+    parser.add_argument("--shape", default="square", choices=["square", "portrait", "landscape"])
+    parser.add_argument("--quality", default="standard", choices=["standard", "hd"])
+    parser.add_argument("--style", default="vivid", choices=["vivid", "natural"])
+    parser.add_argument("--image-workers", type=int, default=DEFAULT_IMAGE_CONCURRENCY, help="Image requests in flight at once")
+    parser.add_argument("--ingest-batch", type=int, default=INGEST_BATCH_SIZE, help="Images added to the catalogue at a time")
+    parser.add_argument("--directory", default="images", help="Catalogue to add the images to")
+    parser.add_argument("--no-cache", action="store_true", help="Don't answer requests from the response cache")
+    parser.add_argument("--names-only", action="store_true", help="Stop once the flowers are named")
+    args = parser.parse_args()
+    if not args.api_key:
+        sys.exit("No API key: pass --api-key or set OPENAI_API_KEY")
+
+    job_dir = JOBS_DIR / args.job
+    job_dir.mkdir(parents=True, exist_ok=True)
+    started = time.perf_counter()
+    try:
+        params = CompletionParameters(top_p=args.top_p, temperature=args.temperature, max_tokens=args.max_tokens)
+        flowers = generate_names(job_dir, args.n, args.model, args.api_key, params, not args.no_cache, args.name_workers)
+        if args.names_only:
+            return
+        added, rejected, failed = generate_images(job_dir, flowers, args.api_key, args.image_model, args.shape, args.quality, args.style,
+                                                  args.directory, args.image_workers, args.ingest_batch, not args.no_cache)
+    except KeyboardInterrupt:
+        sys.exit(f"Interrupted; run the same command again to resume job {args.job!r}")
+    print(f"Added {added} flowers to {args.directory} ({rejected} rejected, {failed} failed) in {time.perf_counter() - started:.0f}s")
+    if failed:
+        sys.exit(f"{failed} images failed; run the same command again to retry them")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Import time of each page and app module, beyond what importing streamlit itself costs (which the server pays once,
+before any page runs), measured with python -X importtime in a fresh interpreter per page or module:
+
+    python benchmarks/import_times.py --top 5 --output import_times.json
+
+For pages this is the cost of their import statements, which the first session to open the page pays. Reported per
+page or module: the total, the number of modules it pulled in, and the ones that took longest themselves. Timings vary
+from run to run by a few milliseconds; -X importtime adds some overhead of its own.
+"""
+import argparse
+import ast
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+REPO = Path(__file__).resolve().parent.parent
+
+PREAMBLE = "import streamlit"
+MARK = "--- imports start here"
+
+
+def page_imports(path: Path) -> str:
+    """
+    The import statements of a page, which can be run without running the page.
+    """
+    tree = ast.parse(path.read_text(encoding="utf-8"))
+    return "\n".join(ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+
+def measure(code: str) -> Dict:
+    program = f"{PREAMBLE}\nimport sys\nprint({MARK!r}, file=sys.stderr, flush=True)\n{code}\n"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", program], cwd=REPO, capture_output=True, text=True)
+    if result.returncode != 0:
+        return {"error": result.stderr.strip().splitlines()[-1]}
+
+    modules = []
+    lines = result.stderr.splitlines()
+    for line in lines[lines.index(MARK) + 1:]:
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append({"module": name.strip(), "depth": len(name) - len(name.lstrip()), "self_ms": int(self_us) / 1000,
+                        "cumulative_ms": int(cumulative_us) / 1000})
+    top_depth = min((m["depth"] for m in modules), default=0)
+    return {"total_ms": sum(m["cumulative_ms"] for m in modules if m["depth"] == top_depth), "modules": len(modules),
+            "slowest": sorted(({"module": m["module"], "self_ms": m["self_ms"]} for m in modules), key=lambda m: -m["self_ms"])}
+
+
+def targets() -> Dict[str, str]:
+    pages = {f"page {path.stem}": page_imports(path) for path in [REPO / "Home.py", *sorted((REPO / "pages").glob("*.py"))]}
+    modules = {f"module {path.stem}": f"import {path.stem}" for path in sorted(REPO.glob("*.py")) if path.name != "Home.py"}
+    return {**pages, **modules}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top", type=int, default=5, help="Slowest modules to list for each page or module")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    report: List[Dict] = []
+    for name, code in targets().items():
+        result = measure(code)
+        report.append({"name": name, **result, "slowest": result.get("slowest", [])[:args.top]})
+        if "error" in result:
+            print(f"{name:<28} failed: {result['error']}")
+            continue
+        slowest = ", ".join(f"{m['module']} {m['self_ms']:.0f}ms" for m in result["slowest"][:args.top])
+        print(f"{name:<28} {result['total_ms']:>7.0f}ms  {result['modules']:>4} modules  {slowest}")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": sys.version.split()[0],
+                                                 "imports": report}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
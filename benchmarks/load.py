@@ -0,0 +1,182 @@
+"""
+Load test of one streamlit process: N simulated sessions work through Home -> Multichoice -> Catalogue -> Generate at
+once, as headless browser tabs (streamlit_client), with the Generate page pointed at a local mock of the OpenAI API
+(benchmarks/mock_openai.py), so nothing is spent on credits.
+
+    python benchmarks/load.py --sessions 1,10,50 --iterations 3 --output load.json
+
+The app and the mock are started as subprocesses, and each level of --sessions is run in turn against the same
+server, so the sweep shows where rerun latency starts to climb. Reported per level: p50/p95/p99 rerun latency (the time
+from sending a rerun to the script finishing, overall and per step), reruns per second, errors, and the server's RSS.
+The mock's options (--latency, --tokens-per-second, --rate-limit-fraction, ...) are passed through to it.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+from typing import Dict, List
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO))
+
+from streamlit_client import Session  # noqa: E402
+
+MOCK_OPTIONS = ["latency", "image_latency", "tokens_per_second", "chunk_tokens", "rate_limit_fraction", "retry_after", "image_size", "description_words"]
+
+
+async def scenario(session: Session, flowers: int):
+    await session.rerun("home", page="Home")
+    await session.rerun("multichoice", page="Multichoice")
+    await session.rerun("multichoice_start", click="Start")
+    choices = [label for kind, label in session.widgets if kind == "button" and label != "Start"]
+    if choices:
+        await session.rerun("multichoice_answer", click=random.choice(choices))
+    await session.rerun("catalogue", page="Catalogue")
+    session.set_value("text_input", "Search", string_value=random.choice(["ro", "lily", "blue", "a", "daisy"]))
+    await session.rerun("catalogue_search")
+    await session.rerun("generate", page="Generate")
+    session.set_value("text_input", "OpenAI API key", string_value="sk-load-test")
+    await session.rerun("generate_key")
+    # The model list only arrives with the key, so pick one the way a user would
+    session.set_value("selectbox", "Model", string_value="gpt-4")
+    await session.rerun("generate_model")
+    session.set_value("checkbox", "Reuse cached responses", bool_value=False)
+    session.set_value("number_input", "Number of flowers to generate", int_value=flowers)
+    await session.rerun("generate_settings")
+    await session.rerun("generate_library", click="Generate library")
+
+
+async def run_session(url: str, iterations: int, flowers: int, start_delay: float) -> Session:
+    await asyncio.sleep(start_delay)  # Stagger connections, as real users don't arrive at the same instant
+    session = Session(url)
+    try:
+        await session.connect()
+        for _ in range(iterations):
+            await scenario(session, flowers)
+    except Exception as e:
+        print(f"Session failed: {e!r}", file=sys.stderr)
+        session.errors += 1
+    finally:
+        session.close()
+    return session
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    if len(values) == 1:
+        return {"p50": values[0], "p95": values[0], "p99": values[0], "count": 1}
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return {"p50": cuts[49], "p95": cuts[94], "p99": cuts[98], "count": len(values)}
+
+
+def rss_kb(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+
+
+async def run_level(url: str, server_pid: int, sessions: int, iterations: int, flowers: int, ramp_up: float) -> Dict:
+    peak_rss = [rss_kb(server_pid)]
+
+    async def sample_rss():
+        while True:
+            peak_rss.append(rss_kb(server_pid))
+            await asyncio.sleep(0.5)
+
+    sampler = asyncio.ensure_future(sample_rss())
+    started = time.perf_counter()
+    done = await asyncio.gather(*[run_session(url, iterations, flowers, ramp_up * i / sessions) for i in range(sessions)])
+    elapsed = time.perf_counter() - started
+    sampler.cancel()
+
+    timings = [t for session in done for t in session.timings]
+    steps = sorted({step for step, _ in timings})
+    return {
+        "sessions": sessions,
+        "seconds": elapsed,
+        "reruns": len(timings),
+        "reruns_per_second": len(timings) / elapsed,
+        "errors": sum(session.errors for session in done),
+        "rerun_seconds": percentiles([t for _, t in timings]),
+        "steps": {step: percentiles([t for s, t in timings if s == step]) for step in steps},
+        "server_rss_kb": {"peak": max(peak_rss), "after": rss_kb(server_pid)},
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"{process.args[1]} exited with status {process.returncode}")
+        try:
+            urllib.request.urlopen(url, timeout=1)
+            return
+        except OSError as e:
+            if getattr(e, "code", None):  # An HTTP error still means it's up
+                return
+            time.sleep(0.2)
+    sys.exit(f"Timed out waiting for {url}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", default="1,5,10", help="Comma separated numbers of concurrent sessions, run in turn")
+    parser.add_argument("--iterations", type=int, default=2, help="Times each session works through the pages")
+    parser.add_argument("--flowers", type=int, default=5, help="Flowers generated by each session's Generate step")
+    parser.add_argument("--ramp-up", type=float, default=2.0, help="Seconds over which sessions connect")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--app-log", help="Write the app's output to this file")
+    for option in MOCK_OPTIONS:
+        parser.add_argument(f"--{option.replace('_', '-')}", help="Passed to the mock OpenAI server")
+    args = parser.parse_args()
+
+    mock_port, app_port = free_port(), free_port()
+    mock_args = [arg for option in MOCK_OPTIONS if (value := getattr(args, option)) is not None for arg in (f"--{option.replace('_', '-')}", value)]
+    mock = subprocess.Popen([sys.executable, str(REPO / "benchmarks" / "mock_openai.py"), "--port", str(mock_port), *mock_args])
+    app_log = open(args.app_log, "w") if args.app_log else subprocess.DEVNULL
+    env = {**os.environ, "OPENAI_BASE_URL": f"http://127.0.0.1:{mock_port}/v1"}
+    app = subprocess.Popen([sys.executable, "-m", "streamlit", "run", "Home.py", "--server.headless", "true", "--server.port", str(app_port),
+                            "--browser.gatherUsageStats", "false"], cwd=REPO, env=env, stdout=app_log, stderr=subprocess.STDOUT)
+    try:
+        wait_for(f"http://127.0.0.1:{mock_port}/v1/models", mock)
+        wait_for(f"http://127.0.0.1:{app_port}/_stcore/health", app)
+        url = f"http://127.0.0.1:{app_port}"
+        results = {"meta": {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "iterations": args.iterations, "flowers": args.flowers,
+                            "mock": {option: getattr(args, option) for option in MOCK_OPTIONS if getattr(args, option) is not None}},
+                   "levels": []}
+        for sessions in [int(s) for s in args.sessions.split(",")]:
+            print(f"Running {sessions} concurrent sessions...", file=sys.stderr)
+            level = asyncio.run(run_level(url, app.pid, sessions, args.iterations, args.flowers, args.ramp_up))
+            results["levels"].append(level)
+            latency = level["rerun_seconds"]
+            print(f"  {sessions:>4} sessions: p50 {latency.get('p50', 0):.3f}s  p95 {latency.get('p95', 0):.3f}s  p99 {latency.get('p99', 0):.3f}s  "
+                  f"{level['reruns_per_second']:.1f} reruns/s  {level['errors']} errors  peak RSS {level['server_rss_kb']['peak'] / 1024:.0f} MB",
+                  file=sys.stderr)
+    finally:
+        app.terminate()
+        mock.terminate()
+        app.wait()
+        mock.wait()
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
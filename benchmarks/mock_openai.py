@@ -0,0 +1,171 @@
+"""
+Local stand-in for the OpenAI endpoints the app uses (models, chat completions with and without streaming, and image
+generation), for load testing without spending API credits.
+
+    python benchmarks/mock_openai.py --port 8600 --latency 0.5 --tokens-per-second 50 --rate-limit-fraction 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8600/v1 streamlit run Home.py
+
+Chat completions answer with a JSON array of made-up flowers, as many as the prompt asks for ("array of <n>"), cut off
+at the request's max_tokens like the real API. Streams are sent in chunks of --chunk-tokens at --tokens-per-second.
+Images are random noise PNGs of --image-size pixels square. A --rate-limit-fraction of requests are answered 429 with a
+Retry-After header. Any API key is accepted.
+"""
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import random
+import re
+import time
+import uuid
+from io import BytesIO
+
+import tornado.ioloop
+import tornado.web
+
+GENERA = ["Rosa", "Lilium", "Tulipa", "Dahlia", "Paeonia", "Iris", "Aster", "Salvia", "Protea", "Banksia", "Anthurium",
+          "Eryngium", "Eustoma", "Gerbera", "Helianthus", "Hydrangea", "Lavandula", "Magnolia", "Narcissus", "Orchis"]
+EPITHETS = ["alba", "rubra", "gigantea", "montana", "vulgaris", "officinalis", "grandiflora", "sylvestris", "elegans",
+            "nana", "aurea", "caerulea", "odorata", "pumila", "speciosa", "variegata"]
+COMMON = ["Rose", "Lily", "Tulip", "Daisy", "Peony", "Iris", "Aster", "Sage", "Thistle", "Bell", "Star", "Wax Flower"]
+COLOURS = ["pink", "white", "scarlet", "golden", "violet", "blue", "cream", "orange", "crimson", "lilac"]
+
+# Characters per token, roughly, for English and JSON
+CHARS_PER_TOKEN = 4
+
+names = itertools.count(1)
+
+
+class Options:
+    latency = 0.3
+    image_latency = 2.0
+    tokens_per_second = 80.0
+    chunk_tokens = 1
+    rate_limit_fraction = 0.0
+    retry_after = 1.0
+    image_size = 512
+    description_words = 20
+    images = []
+
+
+def flower() -> dict:
+    """
+    A made-up flower, with a serial number in its names so that every one is unique.
+    """
+    i = next(names)
+    return {
+        "latin": f"{random.choice(GENERA)} {random.choice(EPITHETS)} {i}",
+        "common": f"{random.choice(COLOURS).title()} {random.choice(COMMON)} {i}",
+        "description": " ".join(random.choice(COLOURS + EPITHETS) for _ in range(Options.description_words)),
+    }
+
+
+def noise_png(size: int, seed: int) -> str:
+    from PIL import Image
+
+    rng = random.Random(seed)
+    img = Image.effect_noise((size, size), rng.uniform(20, 80)).convert("RGB")
+    img = Image.blend(img, Image.new("RGB", (size, size), tuple(rng.randrange(256) for _ in range(3))), 0.6)
+    buffer = BytesIO()
+    img.save(buffer, "PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+class ApiHandler(tornado.web.RequestHandler):
+    def rate_limited(self) -> bool:
+        if random.random() >= Options.rate_limit_fraction:
+            return False
+        self.set_status(429)
+        self.set_header("Retry-After", str(Options.retry_after))
+        self.finish({"error": {"message": "Rate limit reached (mock)", "type": "requests", "param": None, "code": "rate_limit_exceeded"}})
+        return True
+
+    def write_error(self, status_code: int, **kwargs):
+        self.finish({"error": {"message": self._reason, "type": "server_error", "param": None, "code": None}})
+
+
+class ModelsHandler(ApiHandler):
+    def get(self):
+        models = ["gpt-4", "gpt-4-1106-preview", "gpt-3.5-turbo", "dall-e-2", "dall-e-3"]
+        self.finish({"object": "list", "data": [{"id": m, "object": "model", "created": 0, "owned_by": "mock"} for m in models]})
+
+
+class ChatHandler(ApiHandler):
+    async def post(self):
+        if self.rate_limited():
+            return
+        request = json.loads(self.request.body)
+        prompt = " ".join(str(m.get("content", "")) for m in request.get("messages", []))
+        count = int(match.group(1)) if (match := re.search(r"array of (\d+)", prompt)) else 5
+        text = "```json\n" + json.dumps([flower() for _ in range(count)], indent=2) + "\n```"
+        text = text[:(request.get("max_tokens") or 4096) * CHARS_PER_TOKEN]
+        chunk_chars = max(1, Options.chunk_tokens) * CHARS_PER_TOKEN
+        chunks = [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)]
+        delay = max(1, Options.chunk_tokens) / Options.tokens_per_second
+        common = {"id": f"chatcmpl-{uuid.uuid4().hex}", "created": int(time.time()), "model": request.get("model", "gpt-4")}
+
+        await asyncio.sleep(Options.latency)
+        if not request.get("stream"):
+            await asyncio.sleep(delay * len(chunks))
+            self.finish({**common, "object": "chat.completion",
+                         "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                         "usage": {"prompt_tokens": len(prompt) // CHARS_PER_TOKEN, "completion_tokens": len(text) // CHARS_PER_TOKEN,
+                                   "total_tokens": (len(prompt) + len(text)) // CHARS_PER_TOKEN}})
+            return
+
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        for i, chunk in enumerate(chunks):
+            delta = {"role": "assistant", "content": chunk} if i == 0 else {"content": chunk}
+            self.write(f"data: {json.dumps({**common, 'object': 'chat.completion.chunk', 'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}]})}\n\n")
+            await self.flush()
+            await asyncio.sleep(delay)
+        self.write(f"data: {json.dumps({**common, 'object': 'chat.completion.chunk', 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})}\n\n")
+        self.write("data: [DONE]\n\n")
+        self.finish()
+
+
+class ImagesHandler(ApiHandler):
+    async def post(self):
+        if self.rate_limited():
+            return
+        request = json.loads(self.request.body)
+        await asyncio.sleep(Options.image_latency)
+        images = random.sample(Options.images, min(request.get("n", 1), len(Options.images)))
+        self.finish({"created": int(time.time()), "data": [{"b64_json": image, "revised_prompt": request.get("prompt", "")} for image in images]})
+
+
+def make_app() -> tornado.web.Application:
+    return tornado.web.Application([
+        (r"/v1/models", ModelsHandler),
+        (r"/v1/chat/completions", ChatHandler),
+        (r"/v1/images/generations", ImagesHandler),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--latency", type=float, default=Options.latency, help="Seconds before the first token of a chat completion")
+    parser.add_argument("--image-latency", type=float, default=Options.image_latency, help="Seconds to generate an image")
+    parser.add_argument("--tokens-per-second", type=float, default=Options.tokens_per_second)
+    parser.add_argument("--chunk-tokens", type=int, default=Options.chunk_tokens, help="Tokens per streamed chunk")
+    parser.add_argument("--rate-limit-fraction", type=float, default=Options.rate_limit_fraction, help="Fraction of requests answered 429")
+    parser.add_argument("--retry-after", type=float, default=Options.retry_after, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--image-size", type=int, default=Options.image_size, help="Side of generated images, in pixels")
+    parser.add_argument("--description-words", type=int, default=Options.description_words, help="Length of each flower's description")
+    parser.add_argument("--image-variants", type=int, default=16, help="Distinct images to answer with (generated at startup)")
+    args = parser.parse_args()
+
+    for option in ["latency", "image_latency", "tokens_per_second", "chunk_tokens", "rate_limit_fraction", "retry_after", "image_size", "description_words"]:
+        setattr(Options, option, getattr(args, option))
+    Options.images = [noise_png(args.image_size, seed) for seed in range(args.image_variants)]
+
+    make_app().listen(args.port, address="127.0.0.1")
+    print(f"Mock OpenAI API listening on http://127.0.0.1:{args.port}/v1", flush=True)
+    tornado.ioloop.IOLoop.current().start()
+
+
+if __name__ == "__main__":
+    main()
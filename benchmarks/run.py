@@ -0,0 +1,267 @@
+"""
+Benchmarks for the image loader, catalogue search and page reruns, over synthetic flower libraries of several sizes.
+
+    python benchmarks/run.py --sizes 35,1000,10000 --output results.json
+    python benchmarks/run.py --output new.json --baseline results.json
+
+Each library size runs in its own subprocess, so peak RSS is measured per size. Libraries are generated once into
+--work-dir and reused. Catalogue search is also timed on larger synthetic catalogues of --search-sizes records, without
+images. Results are written as JSON; with --baseline, any timing, memory or byte count that has grown by more than
+--threshold (and, for timings, by at least --min-seconds) is reported as a regression and the exit status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+REPO = Path(__file__).resolve().parent.parent
+PAGES = REPO / "pages"
+
+WORDS = ["rose", "lily", "daisy", "orchid", "tulip", "aster", "iris", "poppy", "violet", "dahlia", "peony", "zinnia",
+         "blue", "golden", "wild", "dwarf", "giant", "mountain", "scarlet", "silver", "sea", "star", "thistle", "fern",
+         "chrysanthemum", "eucalyptus", "gypsophila", "lisianthus", "veronica", "amaranthus", "anthurium", "salvia"]
+
+QUERIES = ["", "a", "ro", "ros", "rose", "chrysanth", "chrysnathemum", "blue th", "gold ros", "zzzz"]
+
+# Typed one character at a time, as search-as-you-type sees it
+TYPED_QUERY = "chrysanthemum"
+
+# Results the Catalogue page shows at a time
+PAGE_SIZE = 24
+
+
+def build_library(directory: Path, size: int, image_size=(480, 360)):
+    """
+    Fill `directory` with `size` noisy JPEGs named in the catalogue's "<id>_<latin>_<common>" format, unless it already
+    holds them.
+    """
+    from PIL import Image
+
+    directory.mkdir(parents=True, exist_ok=True)
+    if sum(1 for _ in directory.iterdir()) >= size:
+        return
+    rng = random.Random(size)
+    for i in range(1, size + 1):
+        latin = "-".join(rng.sample(WORDS, 2))
+        common = "-".join(rng.sample(WORDS, 2))
+        img = Image.effect_noise(image_size, rng.uniform(20, 80)).convert("RGB")
+        img = Image.blend(img, Image.new("RGB", image_size, tuple(rng.randrange(256) for _ in range(3))), 0.6)
+        img.save(directory / f"{i}_{latin}_{common}.jpg", "JPEG", quality=80)
+
+
+def timed(func: Callable, repeat: int = 1) -> float:
+    """
+    Median wall-clock seconds of `repeat` calls to `func`.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def bench_image_data() -> Dict[str, float]:
+    import shutil
+    import streamlit as st
+    from images import get_image_data
+
+    shutil.rmtree(".cache", ignore_errors=True)
+    st.cache_resource.clear()
+    cold = timed(get_image_data)  # No manifest: every file is read
+    st.cache_resource.clear()
+    restart = timed(get_image_data)  # Manifest on disk, process caches empty
+    warm = timed(get_image_data, repeat=20)
+    return {"cold_s": cold, "restart_s": restart, "warm_s": warm}
+
+
+def synthetic_records(size: int) -> List[Dict]:
+    """
+    `size` catalogue records named like build_library's images, for benchmarking search without any images.
+    """
+    rng = random.Random(size)
+    return [{"id": str(i), "common": " ".join(rng.sample(WORDS, 2)).title(), "latin": " ".join(rng.sample(WORDS, 2)).capitalize()}
+            for i in range(1, size + 1)]
+
+
+def bench_queries(image_data: List[Dict]) -> Dict[str, float]:
+    """
+    Time to build the search index, and for each query the time to the first page of results, as the Catalogue page
+    shows them, and the slowest keystroke of typing TYPED_QUERY. Queries are timed once, on a fresh index for each sort
+    and for the typing, since the index remembers recent results.
+    """
+    from search import CatalogueIndex, SORT_COMMON, SORT_LATIN
+
+    results = {"build_s": timed(lambda: CatalogueIndex(image_data))}
+    for sort in [SORT_COMMON, SORT_LATIN]:
+        index = CatalogueIndex(image_data)
+        for q in QUERIES:
+            results[f"{sort}|{q}"] = timed(lambda: index.search(q, sort)[:PAGE_SIZE])
+        index = CatalogueIndex(image_data)
+        results[f"{sort}|typing {TYPED_QUERY}"] = max(timed(lambda: index.search(TYPED_QUERY[:length], sort)[:PAGE_SIZE])
+                                                      for length in range(1, len(TYPED_QUERY) + 1))
+    return results
+
+
+def bench_pages() -> Dict[str, Dict[str, float]]:
+    """
+    First run and rerun times of each page, with the bytes a browser would download for its images: media sent
+    through streamlit (st.image), and the distinct renditions referenced by URL from the static route, which a browser
+    fetches once and then caches.
+    """
+    import images
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.testing.v1 import AppTest
+
+    media_bytes = [0]
+    renditions = set()
+    add = MediaFileManager.add
+    get_rendition = images.get_rendition
+
+    def counting_add(self, path_or_data, *args, **kwargs):
+        media_bytes[0] += len(path_or_data) if isinstance(path_or_data, bytes) else os.path.getsize(path_or_data)
+        return add(self, path_or_data, *args, **kwargs)
+
+    def recording_get_rendition(image, rendition="column"):
+        path = get_rendition(image, rendition)
+        renditions.add(path)
+        return path
+
+    def image_bytes() -> int:
+        return sum(os.path.getsize(path) for path in renditions)
+
+    MediaFileManager.add = counting_add
+    images.get_rendition = recording_get_rendition
+
+    def click(label: str) -> Callable[[AppTest], None]:
+        return lambda at: next(b for b in at.button if b.label == label).click()
+
+    scenarios = {
+        "Home": (REPO / "Home.py", []),
+        "Multichoice": (PAGES / "01_Multichoice.py", [click("Start")]),
+        "Spelling": (PAGES / "02_Spelling.py", [click("Begin")]),
+        "Guess": (PAGES / "03_Guess.py", [click("Guess!")]),
+        "Catalogue": (PAGES / "04_Catalogue.py", [lambda at: at.text_input[0].input("ro"), lambda at: at.text_input[0].input("")]),
+        "Generate": (PAGES / "05_Generate.py", []),
+    }
+    results = {}
+    for name, (script, interactions) in scenarios.items():
+        at = AppTest.from_file(str(script), default_timeout=600)
+        media_bytes[0] = 0
+        renditions.clear()
+        first = timed(at.run)
+        first_bytes, first_image_bytes = media_bytes[0], image_bytes()
+        reruns = []
+        for interact in interactions or [lambda at: None]:
+            interact(at)
+            reruns.append(timed(at.run))
+        results[name] = {"first_run_s": first, "rerun_s": statistics.median(reruns), "first_run_media_bytes": first_bytes,
+                         "media_bytes": media_bytes[0], "first_run_image_bytes": first_image_bytes, "image_bytes": image_bytes(),
+                         "errors": len(at.exception)}
+    MediaFileManager.add = add
+    images.get_rendition = get_rendition
+    return results
+
+
+def run_size(size: int, work_dir: Path) -> Dict:
+    library = work_dir / f"library_{size}"
+    build_library(library / "images", size)
+    if not (library / "flormemoru_logo.jpg").exists():
+        (library / "flormemoru_logo.jpg").symlink_to(REPO / "flormemoru_logo.jpg")  # Home page loads it relative to the cwd
+    os.chdir(library)
+    sys.path.insert(0, str(REPO))
+    from images import get_image_data
+
+    results = {
+        "get_image_data": bench_image_data(),
+        "query": bench_queries(get_image_data()),
+        "pages": bench_pages(),
+    }
+    results["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return results
+
+
+def flatten(results: Dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for k, v in results.items():
+        if isinstance(v, dict):
+            flat.update(flatten(v, f"{prefix}{k}."))
+        elif isinstance(v, (int, float)):
+            flat[f"{prefix}{k}"] = v
+    return flat
+
+
+def regressions(results: Dict, baseline: Dict, threshold: float, min_seconds: float) -> List[str]:
+    """
+    Metrics that have grown by more than `threshold` relative to the baseline. Timings must also have grown by at least
+    `min_seconds`, so that jitter in sub-millisecond measurements isn't reported.
+    """
+    current = flatten({"sizes": results["sizes"], "search": results.get("search", {})})
+    previous = flatten({"sizes": baseline["sizes"], "search": baseline.get("search", {})})
+    found = []
+    for metric, value in sorted(current.items()):
+        old = previous.get(metric)
+        is_timing = not metric.endswith(("bytes", "_kb", "errors"))
+        if is_timing and old is not None and value - old < min_seconds:
+            continue
+        if old and not metric.endswith("errors") and value > old * (1 + threshold):
+            found.append(f"{metric}: {old:.6g} -> {value:.6g} (+{(value / old - 1) * 100:.0f}%)")
+        elif metric.endswith("errors") and value > (old or 0):
+            found.append(f"{metric}: {old or 0} -> {value}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="35,1000,10000", help="Comma separated library sizes")
+    parser.add_argument("--search-sizes", default="30000", help="Comma separated sizes of synthetic catalogues to time search on")
+    parser.add_argument("--work-dir", default=str(REPO / ".cache" / "benchmarks"), help="Where synthetic libraries are kept")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Earlier results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Relative growth that counts as a regression")
+    parser.add_argument("--min-seconds", type=float, default=0.02, help="Smallest increase in a timing that counts as a regression")
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)  # Runs a single size (in the subprocess)
+    args = parser.parse_args()
+
+    if args.size is not None:
+        results_out, sys.stdout = sys.stdout, sys.stderr  # Keep anything the app prints out of the results
+        json.dump(run_size(args.size, Path(args.work_dir).resolve()), results_out)
+        return
+
+    results = {"meta": {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(), "platform": platform.platform()},
+               "sizes": {}}
+    for size in [int(s) for s in args.sizes.split(",")]:
+        print(f"Benchmarking library of {size} images...", file=sys.stderr)
+        run = subprocess.run([sys.executable, __file__, "--size", str(size), "--work-dir", args.work_dir], capture_output=True, text=True)
+        if run.returncode != 0:
+            sys.exit(f"Benchmark of {size} images failed:\n{run.stderr}")
+        results["sizes"][str(size)] = json.loads(run.stdout)
+
+    sys.path.insert(0, str(REPO))
+    results["search"] = {}
+    for size in [int(s) for s in args.search_sizes.split(",") if s]:
+        print(f"Benchmarking search of {size} records...", file=sys.stderr)
+        results["search"][str(size)] = bench_queries(synthetic_records(size))
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.baseline:
+        found = regressions(results, json.loads(Path(args.baseline).read_text()), args.threshold, args.min_seconds)
+        for regression in found:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        sys.exit(1 if found else 0)
+
+
+if __name__ == "__main__":
+    main()
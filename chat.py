@@ -1,25 +1,68 @@
 import base64
+import functools
+import logging
+import math
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from io import BytesIO
-from typing import Literal, List, Dict
+from typing import TYPE_CHECKING, Any, Hashable, Literal, List, Dict, Callable, Iterator, Optional, Tuple, TypeVar, Union
 import json
 
 import streamlit as st
+import tiktoken
 from json_repair import repair_json
-from openai import OpenAI
+
+import client_pool
+import metrics
+import response_cache
+from lazy_imports import lazy_import
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+# Only needed once a request is made, so pages that never make one don't import it
+openai = lazy_import("openai")
+
+logger = logging.getLogger(__name__)
 
 ShapeLiteral = Literal["square", "portrait", "landscape"]
 QualityLiteral = Literal["standard", "hd"]
 StyleLiteral = Literal["vivid", "natural"]
 
+T = TypeVar("T")
 
-class OpenAiCompletionParameters:
-    def __init__(self, name):
-        self.name = name
-        self.top_p = st.slider("top_p", value=1.0, min_value=0.0, max_value=1.0, key=f"top_p:{self.name}", help="An alternative to sampling with temperature, called nucleus sampling, where the model considers the results of the tokens with `top_p` probability mass. So `0.1` means only the tokens comprising the top `10%` probability mass are considered. We generally recommend altering this or `temperature` but not both. Defaults to `1.0`")
-        self.temperature = st.slider("temperature", value=1.0, min_value=0.0, max_value=2.0, key=f"temperature:{self.name}", help="What sampling temperature to use, between `0` and `2`. Higher values like `0.8` will make the output more random, while lower values like `0.2` will make it more focused and deterministic. We generally recommend altering this or `top_p` but not both. Defaults to `1.0`")
-        self.presence_penalty = st.slider("presence_penalty", value=0.0, min_value=-2.0, max_value=2.0, key=f"presence_penalty:{self.name}", help="Number between `-2.0` and `2.0`. Positive values penalize new tokens based on whether they appear in the text so far, increasing the model's likelihood to talk about new topics. Defaults to `0.0`")
-        self.frequency_penalty = st.slider("frequency_penalty", value=0.0, min_value=-2.0, max_value=2.0, key=f"frequency_penalty:{self.name}", help="Number between `-2.0` and `2.0`. Positive values penalize new tokens based on their existing frequency in the text so far, decreasing the model's likelihood to repeat the same line verbatim. Defaults to `0.0`")
-        self.max_tokens = st.number_input("max_tokens", value=2048, min_value=100, max_value=8192, key=f"max_tokens:{self.name}", help="The maximum number of tokens to generate in the chat completion. The total length of input tokens and generated tokens is limited by the model's context length. Defaults to `512`")
+DEFAULT_IMAGE_CONCURRENCY = 4
+RETRIES = 5
+RETRY_MAX_DELAY = 60.0
+STREAM_FRAME_RATE = 10  # Maximum redraws per second of streamed output
+
+DEFAULT_MAX_TOKENS = 2048
+DEFAULT_SHARD_CONCURRENCY = 16
+SHARD_TOKEN_MARGIN = 1.5  # Generated items vary in length, so shards are sized for items this much longer than the example
+SHARD_ROUNDS = 5  # Rounds of requests made to replace duplicates, before settling for fewer items
+SHARD_OVERSAMPLING = 1.5
+
+
+class CompletionParameters:
+    """
+    Sampling parameters for chat completions. These are fixed values, for use outside a streamlit script; in the app
+    they're chosen with widgets (OpenAiCompletionParameters).
+    """
+
+    def __init__(self, top_p: float = 1.0, temperature: float = 1.0, presence_penalty: float = 0.0, frequency_penalty: float = 0.0,
+                 max_tokens: int = DEFAULT_MAX_TOKENS):
+        self.top_p = top_p
+        self.temperature = temperature
+        self.presence_penalty = presence_penalty
+        self.frequency_penalty = frequency_penalty
+        self.max_tokens = max_tokens
+
+    def sampling_params(self) -> Dict:
+        return {"top_p": self.top_p, "temperature": self.temperature, "presence_penalty": self.presence_penalty,
+                "frequency_penalty": self.frequency_penalty, "max_tokens": self.max_tokens}
 
     def create_chat_completion(self, model: str, messages: List[Dict], api_key: str, stream=True, functions=None, tools=None):
         if functions:  # annoying that we can't just pass None without error (at least pre-v1 anyways)
@@ -36,35 +79,251 @@ class OpenAiCompletionParameters:
                                                                 frequency_penalty=self.frequency_penalty, max_tokens=self.max_tokens)
 
 
-@st.cache_resource()
-def chat_client(api_key: str):
-    return OpenAI(api_key=api_key)
+class OpenAiCompletionParameters(CompletionParameters):
+    def __init__(self, name):
+        self.name = name
+        self.top_p = st.slider("top_p", value=1.0, min_value=0.0, max_value=1.0, key=f"top_p:{self.name}", help="An alternative to sampling with temperature, called nucleus sampling, where the model considers the results of the tokens with `top_p` probability mass. So `0.1` means only the tokens comprising the top `10%` probability mass are considered. We generally recommend altering this or `temperature` but not both. Defaults to `1.0`")
+        self.temperature = st.slider("temperature", value=1.0, min_value=0.0, max_value=2.0, key=f"temperature:{self.name}", help="What sampling temperature to use, between `0` and `2`. Higher values like `0.8` will make the output more random, while lower values like `0.2` will make it more focused and deterministic. We generally recommend altering this or `top_p` but not both. Defaults to `1.0`")
+        self.presence_penalty = st.slider("presence_penalty", value=0.0, min_value=-2.0, max_value=2.0, key=f"presence_penalty:{self.name}", help="Number between `-2.0` and `2.0`. Positive values penalize new tokens based on whether they appear in the text so far, increasing the model's likelihood to talk about new topics. Defaults to `0.0`")
+        self.frequency_penalty = st.slider("frequency_penalty", value=0.0, min_value=-2.0, max_value=2.0, key=f"frequency_penalty:{self.name}", help="Number between `-2.0` and `2.0`. Positive values penalize new tokens based on their existing frequency in the text so far, decreasing the model's likelihood to repeat the same line verbatim. Defaults to `0.0`")
+        self.max_tokens = st.number_input("max_tokens", value=2048, min_value=100, max_value=8192, key=f"max_tokens:{self.name}", help="The maximum number of tokens to generate in the chat completion. The total length of input tokens and generated tokens is limited by the model's context length. Defaults to `512`")
+
+
+def chat_client(api_key: str) -> "OpenAI":
+    """
+    The client for `api_key`, from the process-wide pool (see client_pool). Safe to call from any thread. Requests made
+    with it should hold one of the key's slots (client_pool.limit), streamed ones one of its stream slots.
+    """
+    return client_pool.get(api_key)
 
 
 @st.cache_data(ttl="1h")
 def list_models(api_key: str) -> List[str]:
-    return [m.id for m in chat_client(api_key).models.list().data]
+    return [m.id for m in with_retries(lambda: chat_client(api_key).models.list(), api_key).data]
 
 
-def stream_json(prompt: str, model: str, api_key: str, model_params=None, existing_messages: List[Dict] = None, container=None):
+def stream_json(prompt: str, model: str, api_key: str, model_params=None, existing_messages: List[Dict] = None, container=None, use_cache: bool = True,
+                on_item: Callable[[Dict], None] = None):
     """
     Stream the JSON from a chat model response into a streamlit container. When stream completes, repair the JSON, strip any
     markdown ```json``` syntax, then return the parsed object from the json.
+    If the response is an array, `on_item` is called with each of its objects as soon as that object is complete, so that
+    work on early items can start while later ones are still streaming. The container is redrawn at most
+    STREAM_FRAME_RATE times a second.
+    Responses are cached on disk by request content, so an identical request is answered without calling the API unless
+    `use_cache` is False.
     TODO: Doesn't yet use the force JSON parameter.
     """
     json_placeholder = st.empty() if container is None else container
-    full_json = ""
+    chunks = []
+    parser = JsonArrayStreamParser()
+    on_item = on_item or (lambda item: None)
     messages = [{"role": "system", "content": prompt}]
     if existing_messages:
         messages += content_role_only_list(existing_messages)
-    for response in model_params.create_chat_completion(model, messages, api_key) if model_params is not None else default_chat_completion(model, messages, api_key):
-        if content := response.choices[0].delta.content:
-            full_json += content
-        json_placeholder.code(full_json + "▌", language="json")
+
+    key = response_cache.cache_key(kind="chat", model=model, messages=messages, params=model_params.sampling_params() if model_params is not None else None)
+    if use_cache and (cached := response_cache.get(key)) is not None:
+        full_json = cached.decode("utf-8")
+        json_placeholder.code(full_json, language="json")
+        for item in parser.feed(full_json):
+            on_item(item)
+        return json.loads(repair_json(strip_json_markdown_tag(full_json)))
+
+    last_frame = 0.0
+    started = time.perf_counter()
+    with client_pool.limit(api_key, stream=True):
+        create = (lambda: model_params.create_chat_completion(model, messages, api_key)) if model_params is not None else (lambda: default_chat_completion(model, messages, api_key))
+        for response in with_retries(create):
+            if content := response.choices[0].delta.content:
+                if not chunks:
+                    metrics.observe("openai_chat_first_token_seconds", time.perf_counter() - started, model=model)
+                chunks.append(content)
+                for item in parser.feed(content):
+                    on_item(item)
+            if time.monotonic() - last_frame >= 1 / STREAM_FRAME_RATE:
+                json_placeholder.code("".join(chunks) + "▌", language="json")
+                last_frame = time.monotonic()
+    metrics.observe("openai_chat_seconds", time.perf_counter() - started, model=model)
+    full_json = "".join(chunks)
     json_placeholder.code(full_json, language="json")
+    response_cache.put(key, full_json.encode("utf-8"))
+    return json.loads(repair_json(strip_json_markdown_tag(full_json)))
+
+
+class JsonArrayStreamParser:
+    """
+    Incremental parser for a JSON array arriving in arbitrary chunks. feed() returns the array's object elements that
+    were completed by the chunk. Anything before the opening bracket (such as a markdown ```json``` tag) is skipped.
+    """
+
+    def __init__(self):
+        self._depth = 0  # 1 inside the top-level array, 2+ inside one of its elements
+        self._in_string = False
+        self._escaped = False
+        self._finished = False
+        self._element = []
+
+    def feed(self, text: str) -> List[Dict]:
+        completed = []
+        for c in text:
+            if self._finished:
+                break
+            if self._depth == 0:
+                if c == "[":
+                    self._depth = 1
+                continue
+
+            if self._depth > 1:
+                self._element.append(c)
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif c == "\\":
+                    self._escaped = True
+                elif c == '"':
+                    self._in_string = False
+            elif c == '"':
+                self._in_string = True
+            elif c in "[{":
+                self._depth += 1
+                if self._depth == 2:
+                    self._element.append(c)
+            elif c in "]}":
+                self._depth -= 1
+                if self._depth == 1:
+                    if c == "}" and (item := self._parse("".join(self._element))) is not None:
+                        completed.append(item)
+                    self._element = []
+                elif self._depth == 0:
+                    self._finished = True
+        return completed
+
+    @staticmethod
+    def _parse(element: str):
+        try:
+            return json.loads(element)
+        except json.JSONDecodeError:
+            try:
+                return json.loads(repair_json(element)) or None
+            except json.JSONDecodeError:
+                return None  # Left for the repair of the full response once the stream ends
+
+
+def complete_json(client: "OpenAI", prompt: str, model: str, sampling_params: Optional[Dict] = None, use_cache: bool = True):
+    """
+    Non-streaming version of stream_json, with no UI, so that it can be called from worker threads. Shares
+    stream_json's response cache.
+    """
+    messages = [{"role": "system", "content": prompt}]
+    key = response_cache.cache_key(kind="chat", model=model, messages=messages, params=sampling_params)
+    if use_cache and (cached := response_cache.get(key)) is not None:
+        full_json = cached.decode("utf-8")
+    else:
+        with metrics.timer("openai_chat_seconds", model=model):
+            response = with_retries(lambda: client.chat.completions.create(model=model, messages=messages, stream=False, **(sampling_params or {})), client.api_key)
+        full_json = response.choices[0].message.content or ""
+        response_cache.put(key, full_json.encode("utf-8"))
     return json.loads(repair_json(strip_json_markdown_tag(full_json)))
 
 
+@functools.lru_cache()
+def token_encoding(model: str) -> Optional[tiktoken.Encoding]:
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None  # Encodings are downloaded on first use, which can fail offline
+
+
+def count_tokens(text: str, model: str) -> int:
+    if (encoding := token_encoding(model)) is None:
+        return math.ceil(len(text) / 3)  # Pessimistic, since most English tokens are about 4 characters
+    return len(encoding.encode(text))
+
+
+def items_per_request(example_item: Dict, model: str, max_tokens: int) -> int:
+    """
+    How many JSON objects like `example_item` fit in one completion of at most `max_tokens` tokens.
+    """
+    item_tokens = count_tokens(json.dumps(example_item, indent=2) + ",\n", model) * SHARD_TOKEN_MARGIN
+    return max(1, int((max_tokens - count_tokens("```json\n[\n]\n```", model)) / item_tokens))
+
+
+def add_unique_items(items: Any, item_keys: Callable[[Dict], List[Tuple[str, Hashable]]], unique: List[Dict], seen: set) -> List[Dict]:
+    """
+    Append the objects in `items` (a parsed JSON response, which may not be a list) that aren't duplicates to `unique`,
+    adding their keys to `seen`, and return them. See generate_json_items for what counts as a duplicate.
+    """
+    added = []
+    for item in items if isinstance(items, list) else []:
+        keys = item_keys(item) if isinstance(item, dict) else []
+        if keys and all(value for _, value in keys) and seen.isdisjoint(keys):
+            added.append(item)
+            seen.update(keys)
+    unique.extend(added)
+    return added
+
+
+def generate_json_items(n: int, prompt: Callable[[int, int, int, List[Dict]], str], item_keys: Callable[[Dict], List[Tuple[str, Hashable]]], example_item: Dict,
+                        model: str, api_key: str, model_params=None, use_cache: bool = True, max_workers: int = DEFAULT_SHARD_CONCURRENCY,
+                        on_progress: Callable[[int], None] = None, existing: List[Dict] = (), on_items: Callable[[List[Dict]], None] = None) -> List[Dict]:
+    """
+    Generate `n` distinct JSON objects in parallel requests (shards), each sized using tiktoken and `example_item` to
+    fit within the completion's max_tokens. `item_keys` returns an object's (kind, value) keys; it is a duplicate if any
+    of them has been seen before, and is dropped if any of their values is empty. If duplicates leave fewer than `n`, further shards are requested for the
+    remainder (for up to SHARD_ROUNDS rounds).
+    `prompt(count, shard, shards, existing)` should return a prompt for a JSON array of `count` objects, where
+    `existing` are the objects already generated, which it may ask the model to avoid. `on_progress` is called (in the
+    calling thread) with the number of distinct objects so far, each time a shard finishes, and `on_items` with the
+    objects it added. Objects in `existing` (e.g. from an interrupted run) count towards `n` and are avoided like the
+    generated ones.
+    Failed shards are logged and skipped, unless none has succeeded after the first round, in which case the first
+    shard's error is raised (e.g. for an invalid API key or exhausted quota).
+    """
+    client = chat_client(api_key)
+    sampling_params = model_params.sampling_params() if model_params is not None else {"max_tokens": DEFAULT_MAX_TOKENS}
+    per_request = items_per_request(example_item, model, sampling_params["max_tokens"])
+    on_progress = on_progress or (lambda count: None)
+    on_items = on_items or (lambda items: None)
+    unique = []
+    seen = set()
+    errors = []
+    succeeded = False
+    for item in existing:
+        unique.append(item)
+        seen.update(item_keys(item))
+
+    for round_ in range(SHARD_ROUNDS):
+        if len(unique) >= n:
+            break
+        # After the first round, ask for more than are missing, since some of them will be duplicates too
+        wanted = math.ceil((n - len(unique)) * (1 if round_ == 0 else SHARD_OVERSAMPLING))
+        shards = math.ceil(wanted / per_request)
+        counts = [wanted // shards + (i < wanted % shards) for i in range(shards)]
+        existing = list(unique)
+        with ThreadPoolExecutor(max_workers=min(max_workers, shards)) as executor:
+            futures = [executor.submit(complete_json, client, prompt(count, i, shards, existing), model, sampling_params, use_cache)
+                       for i, count in enumerate(counts)]
+            for future in as_completed(futures):
+                try:
+                    items = future.result()
+                except Exception as e:
+                    logger.warning("Shard of %s failed: %r", model, e)
+                    errors.append(e)
+                    continue
+                succeeded = True
+                if added := add_unique_items(items, item_keys, unique, seen):
+                    on_items(added)
+                on_progress(min(len(unique), n))
+        if not succeeded:
+            raise errors[0]
+
+    return unique[:n]
+
+
 def strip_json_markdown_tag(json_string: str):
     """
     Strips triple backtick json markdown markers if present.
@@ -89,20 +348,147 @@ def extract_only_api_props(msg):
 
 
 
-def generate_images(prompt: str, n: int, api_key: str, model="dall-e-2", shape: ShapeLiteral = "square", quality: QualityLiteral = "standard", style: StyleLiteral = "vivid"):
+def generate_images(prompt: str, n: int, api_key: str, model="dall-e-2", shape: ShapeLiteral = "square", quality: QualityLiteral = "standard", style: StyleLiteral = "vivid",
+                    max_workers: int = DEFAULT_IMAGE_CONCURRENCY, use_cache: bool = True):
+    client = chat_client(api_key)
     if model == "dall-e-2":
-        response = chat_client(api_key).images.generate(prompt=prompt, model=model, n=n, size=image_size(model, shape), response_format="b64_json")
-        return [b64_json_image_to_bytes_io(encoded) for encoded in response.data]
-    elif model == "dall-e-3":
-        images = []
-        for i in range(n):
-            response = chat_client(api_key).images.generate(prompt=prompt, model=model, n=1, size=image_size(model, shape), response_format="b64_json", quality=quality, style=style)
-            images.append(b64_json_image_to_bytes_io(response.data[0]))
+        keys = [image_cache_key(prompt, model, shape, quality, style, variant) for variant in range(n)]
+        if use_cache and all((cached := [response_cache.get(key) for key in keys])):
+            return [BytesIO(data) for data in cached]
+        with metrics.timer("openai_image_seconds", model=model):
+            response = with_retries(lambda: client.images.generate(prompt=prompt, model=model, n=n, size=image_size(model, shape), response_format="b64_json"), api_key)
+        images = [b64_json_image_to_bytes_io(encoded) for encoded in response.data]
+        for key, image in zip(keys, images):
+            response_cache.put(key, image.getvalue())
         return images
+    elif model == "dall-e-3":
+        # dall-e-3 only generates one image per request, so make the requests in parallel
+        with ThreadPoolExecutor(max_workers=max(1, min(n, max_workers))) as executor:
+            return list(executor.map(lambda variant: generate_image(client, prompt, model, shape, quality, style, use_cache, variant), range(n)))
     else:
         raise ValueError(f"Unknown image model {model}")
 
 
+def generate_image_batch(prompts: List[str], api_key: str, model="dall-e-3", shape: ShapeLiteral = "square", quality: QualityLiteral = "standard", style: StyleLiteral = "vivid",
+                         max_workers: int = DEFAULT_IMAGE_CONCURRENCY, use_cache: bool = True) -> Iterator[Tuple[int, Union[BytesIO, Exception]]]:
+    """
+    Generate one image per prompt, with up to `max_workers` requests in flight at once. Yields (prompt index, image)
+    pairs in order of completion, so callers can report progress; a request that fails yields its exception in place of
+    the image rather than abandoning the rest of the batch.
+    """
+    with ImagePipeline(api_key, model, shape, quality, style, max_workers=max_workers, max_pending=None, use_cache=use_cache) as pipeline:
+        for prompt in prompts:
+            pipeline.submit(prompt)
+        yield from pipeline.wait()
+
+
+class ImagePipeline:
+    """
+    Pool of image generation workers that prompts can be fed to one at a time, e.g. as they arrive from a stream.
+    submit() blocks once `max_pending` prompts are waiting for a worker (None for no limit), so a fast producer can't
+    queue unbounded work. Results are (submission index, image) pairs, with a failed request's exception in place of
+    its image; completed() collects those finished so far without blocking, and wait() the rest as they finish.
+    """
+
+    def __init__(self, api_key: str, model="dall-e-3", shape: ShapeLiteral = "square", quality: QualityLiteral = "standard", style: StyleLiteral = "vivid",
+                 max_workers: int = DEFAULT_IMAGE_CONCURRENCY, max_pending: Optional[int] = DEFAULT_IMAGE_CONCURRENCY, use_cache: bool = True):
+        self.client = chat_client(api_key)
+        self.options = (model, shape, quality, style, use_cache)
+        self.submitted = 0
+        self.collected = 0
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        self._slots = threading.BoundedSemaphore(max(1, max_workers) + max_pending) if max_pending is not None else None
+        self._results = queue.Queue()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._executor.shutdown(wait=exc[0] is None, cancel_futures=exc[0] is not None)
+
+    def submit(self, prompt: str) -> int:
+        if self._slots is not None:
+            self._slots.acquire()
+        index = self.submitted
+        self.submitted += 1
+        future = self._executor.submit(generate_image, self.client, prompt, *self.options)
+        future.add_done_callback(lambda f: self._finished(index, f))
+        return index
+
+    def _finished(self, index: int, future):
+        if self._slots is not None:
+            self._slots.release()
+        try:
+            self._results.put((index, future.result()))
+        except Exception as e:
+            self._results.put((index, e))
+
+    def completed(self) -> List[Tuple[int, Union[BytesIO, Exception]]]:
+        results = []
+        while True:
+            try:
+                results.append(self._results.get_nowait())
+            except queue.Empty:
+                break
+        self.collected += len(results)
+        return results
+
+    def wait(self) -> Iterator[Tuple[int, Union[BytesIO, Exception]]]:
+        while self.collected < self.submitted:
+            result = self._results.get()
+            self.collected += 1
+            yield result
+
+
+def generate_image(client: "OpenAI", prompt: str, model="dall-e-3", shape: ShapeLiteral = "square", quality: QualityLiteral = "standard", style: StyleLiteral = "vivid",
+                   use_cache: bool = True, variant: int = 0) -> BytesIO:
+    """
+    Generate a single image. `variant` distinguishes repeated requests for the same prompt in the response cache.
+    """
+    key = image_cache_key(prompt, model, shape, quality, style, variant)
+    if use_cache and (cached := response_cache.get(key)) is not None:
+        return BytesIO(cached)
+    with metrics.timer("openai_image_seconds", model=model):
+        if model == "dall-e-2":
+            response = with_retries(lambda: client.images.generate(prompt=prompt, model=model, n=1, size=image_size(model, shape), response_format="b64_json"), client.api_key)
+        else:
+            response = with_retries(lambda: client.images.generate(prompt=prompt, model=model, n=1, size=image_size(model, shape), response_format="b64_json", quality=quality, style=style), client.api_key)
+    image = b64_json_image_to_bytes_io(response.data[0])
+    response_cache.put(key, image.getvalue())
+    return image
+
+
+def image_cache_key(prompt: str, model: str, shape: ShapeLiteral, quality: QualityLiteral, style: StyleLiteral, variant: int) -> str:
+    if model == "dall-e-2":
+        quality, style = None, None  # Not supported by dall-e-2, so they don't affect the result
+    return response_cache.cache_key(kind="image", prompt=prompt, model=model, size=image_size(model, shape), quality=quality, style=style, variant=variant)
+
+
+def with_retries(request: Callable[[], T], api_key: Optional[str] = None, retries: int = RETRIES) -> T:
+    """
+    Call `request`, retrying with jittered exponential backoff (or the server's Retry-After, if given) when the API
+    responds 429 or 5xx, or can't be reached. This is the only retrying done: the SDK's own is turned off
+    (client_pool.MAX_RETRIES). Given `api_key`, each attempt holds one of the key's request slots, which is released
+    while waiting to retry.
+    """
+    for attempt in range(retries + 1):
+        try:
+            if api_key is None:
+                return request()
+            with client_pool.limit(api_key):
+                return request()
+        except (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError) as e:
+            if attempt == retries:
+                raise
+            metrics.inc("openai_retries_total", error=type(e).__name__)
+            retry_after = e.response.headers.get("retry-after") if isinstance(e, openai.APIStatusError) else None
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = 2 ** attempt
+            time.sleep(min(RETRY_MAX_DELAY, delay) * random.uniform(1.0, 1.25))
+
+
 def b64_json_image_to_bytes_io(b64_image):
     return BytesIO(base64.b64decode(b64_image.b64_json))
 
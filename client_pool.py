@@ -0,0 +1,152 @@
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional
+
+import metrics
+from lazy_imports import lazy_import
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+# Imported when the first client is made (most of the app's import time otherwise)
+httpx = lazy_import("httpx")
+openai = lazy_import("openai")
+
+# Where requests are sent, e.g. a local stand-in for load testing (benchmarks/mock_openai.py). None for the real API.
+BASE_URL = os.environ.get("OPENAI_BASE_URL") or None
+
+# Connections to the API are shared by every client (and so every key and session) in the process
+MAX_CONNECTIONS = int(os.environ.get("FLORMEMORU_OPENAI_MAX_CONNECTIONS", "64"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("FLORMEMORU_OPENAI_MAX_KEEPALIVE", "32"))
+KEEPALIVE_SECONDS = 90.0
+CONNECT_TIMEOUT = float(os.environ.get("FLORMEMORU_OPENAI_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = float(os.environ.get("FLORMEMORU_OPENAI_READ_TIMEOUT", "120"))  # Image generation can take a minute
+HTTP2 = os.environ.get("FLORMEMORU_OPENAI_HTTP2", "") == "1"  # Needs the h2 package: pip install httpx[http2]
+MAX_RETRIES = 0  # All retrying is done by chat.with_retries, which doesn't hold a request slot while it waits
+
+# One client per API key, dropped when least recently used beyond MAX_CLIENTS or unused for CLIENT_TTL_SECONDS
+MAX_CLIENTS = int(os.environ.get("FLORMEMORU_OPENAI_MAX_CLIENTS", "256"))
+CLIENT_TTL_SECONDS = 60 * 60
+
+# Requests in flight per API key, across image generation, non-streamed chat and all sessions using the key
+PER_KEY_CONCURRENCY = int(os.environ.get("FLORMEMORU_OPENAI_PER_KEY_CONCURRENCY", "16"))
+# Streamed chat requests in flight per API key. These have slots of their own (see ClientPool.limit).
+PER_KEY_STREAM_CONCURRENCY = int(os.environ.get("FLORMEMORU_OPENAI_PER_KEY_STREAMS", "16"))
+
+
+def http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def shared_http_client() -> "httpx.Client":
+    return httpx.Client(
+        limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS, keepalive_expiry=KEEPALIVE_SECONDS),
+        timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+        http2=HTTP2 and http2_available(),
+        follow_redirects=True,
+    )
+
+
+class ClientPool:
+    """
+    OpenAI clients by API key, bounded in number and age, all sending requests over one keep-alive httpx connection
+    pool. Each key also has semaphores (see limit()) so that the requests made with it are capped no matter how many
+    threads or sessions are making them.
+    """
+
+    def __init__(self, http_client: "httpx.Client", max_clients: int = MAX_CLIENTS, ttl: float = CLIENT_TTL_SECONDS,
+                 per_key_concurrency: int = PER_KEY_CONCURRENCY, per_key_streams: int = PER_KEY_STREAM_CONCURRENCY):
+        self.http_client = http_client
+        self.max_clients = max_clients
+        self.ttl = ttl
+        self.per_key_concurrency = per_key_concurrency
+        self.per_key_streams = per_key_streams
+        self._clients = OrderedDict()  # API key -> (client, last used)
+        # Semaphores live as long as anyone holds one, so a key's limit survives its client being evicted mid-request
+        self._semaphores = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+        self._last_warm_up = 0.0
+
+    def get(self, api_key: str) -> "OpenAI":
+        now = time.monotonic()
+        with self._lock:
+            if (entry := self._clients.pop(api_key, None)) is not None and now - entry[1] < self.ttl:
+                client = entry[0]
+            else:
+                metrics.inc("openai_clients_created_total")
+                # Closing an evicted client would close the shared connection pool, so they're only ever dropped
+                client = openai.OpenAI(api_key=api_key, base_url=BASE_URL, http_client=self.http_client, max_retries=MAX_RETRIES)
+            self._clients[api_key] = (client, now)
+            while len(self._clients) > self.max_clients or now - next(iter(self._clients.values()))[1] >= self.ttl:
+                self._clients.popitem(last=False)
+            return client
+
+    def semaphore(self, api_key: str, stream: bool = False) -> threading.BoundedSemaphore:
+        with self._lock:
+            if (semaphore := self._semaphores.get((api_key, stream))) is None:
+                semaphore = threading.BoundedSemaphore(self.per_key_streams if stream else self.per_key_concurrency)
+                self._semaphores[(api_key, stream)] = semaphore
+            return semaphore
+
+    @contextmanager
+    def limit(self, api_key: str, stream: bool = False):
+        """
+        Hold one of `api_key`'s request slots for the duration of the block, waiting for one if they're all taken.
+        A streamed request (`stream`) holds its slot while its consumer handles each chunk, which may itself wait on
+        other requests with the key (e.g. stream_json's on_item submitting to an ImagePipeline), so streams have slots
+        of their own: if they took the shared ones, enough of them could starve the requests they're waiting on.
+        """
+        semaphore = self.semaphore(api_key, stream)
+        if not semaphore.acquire(blocking=False):
+            metrics.inc("openai_request_slot_waits_total")
+            semaphore.acquire()
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    def warm_up(self, base_url: Optional[str] = None):
+        """
+        Open a connection to the API in the background (at most once per keep-alive period), so that the first real
+        request doesn't pay for DNS, TCP and TLS setup.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_warm_up < KEEPALIVE_SECONDS:
+                return
+            self._last_warm_up = now
+        url = base_url or BASE_URL or "https://api.openai.com/v1"
+        threading.Thread(target=self._connect, args=(url,), name="openai-warm-up", daemon=True).start()
+
+    def _connect(self, url: str):
+        try:
+            # Unauthenticated, so the answer is an error, but the connection stays in the pool
+            self.http_client.get(f"{url.rstrip('/')}/models").close()
+        except httpx.HTTPError:
+            pass
+
+
+@lru_cache(maxsize=None)
+def default_pool() -> ClientPool:
+    return ClientPool(shared_http_client())
+
+
+def get(api_key: str) -> "OpenAI":
+    return default_pool().get(api_key)
+
+
+def limit(api_key: str, stream: bool = False):
+    return default_pool().limit(api_key, stream)
+
+
+def warm_up():
+    default_pool().warm_up()
@@ -0,0 +1,52 @@
+import string
+from typing import Dict, List, Tuple
+
+from ingest import filename_part
+
+# What one generated flower looks like, for sizing requests
+EXAMPLE_FLOWER = {
+    "latin": "Chamelaucium uncinatum",
+    "common": "Geraldton Wax Flower",
+    "description": "A woody shrub with needle-like leaves and clusters of small, waxy, five-petalled pink and white "
+                   "flowers with darker centres.",
+}
+
+# Flowers a prompt asks the model to avoid, at most (the most recently generated), so that prompts for big batches
+# don't grow with the batch. Duplicates beyond these are still dropped by flower_keys.
+MAX_AVOIDED_FLOWERS = 300
+
+
+def flower_names_prompt(n: int) -> str:
+    return f"""
+    Generate a JSON array of {n} JSON objects, where each JSON object represents a random flower.
+    Each of the {n} JSON objects should have the following 3 properties:
+    1. "latin" (string): the latin name of the flower
+    2. "common" (string): the common name of the flower.
+    3. "description" (string): a short visual description of an example of this flower.
+    Ensure that your response contains only valid JSON.
+    """
+
+
+def flower_names_shard_prompt(count: int, shard: int, shards: int, existing: List[Dict[str, str]]) -> str:
+    prompt = flower_names_prompt(count)
+    if shards > 1 and not existing:
+        # Give each shard different initials, so that they don't all come up with the same favourites
+        initials = string.ascii_uppercase[shard * 26 // shards:(shard + 1) * 26 // shards] or string.ascii_uppercase[shard % 26]
+        prompt += f"Only include flowers whose latin name starts with one of the letters {', '.join(initials)}.\n"
+    if existing:
+        prompt += f"Don't include any of these flowers: {', '.join(flower['latin'] for flower in existing[-MAX_AVOIDED_FLOWERS:])}.\n"
+    return prompt
+
+
+def flower_keys(flower: Dict[str, str]) -> List[Tuple[str, str]]:
+    """
+    Two flowers are the same if they have the same latin or common name, as they'd appear in a catalogue filename.
+    """
+    return [("latin", filename_part(str(flower.get("latin", "")))), ("common", filename_part(str(flower.get("common", ""))))]
+
+
+def flower_image_prompt(flower: Dict[str, str]) -> str:
+    return f"""
+    A high quality photograph of a bunch of the following flower: 
+    {flower['common']} (latin name: {flower['latin']}). Description: {flower.get('description', '')}
+    """
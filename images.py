@@ -1,45 +1,155 @@
-import io
+import html
 import os
+import threading
 from pathlib import Path
 from typing import List, Dict
 
 import streamlit as st
+from PIL import Image, ImageOps
+
+import manifest
+import metrics
+from search import CatalogueIndex
+from similarity import SimilarityIndex, build_index
+
+# Fixed widths (in pixels) of the resized copies we serve instead of the originals
+RENDITION_WIDTHS = {"thumbnail": 360, "column": 720, "full": 1440}
+
+# Renditions are written into the app's static folder, which streamlit serves at STATIC_URL (see .streamlit/config.toml)
+STATIC_DIR = Path("static")
+STATIC_URL = "app/static"
+DERIVATIVE_DIR = STATIC_DIR / "renditions"
+
+# Approximate content widths of streamlit's page layouts, used to pick a rendition
+CENTERED_LAYOUT_WIDTH = 704
+WIDE_LAYOUT_WIDTH = 1200
 
 
-@st.cache_resource(ttl="1hr")
 def get_image_data(directory: str = "images") -> List[Dict]:
-    with st.spinner("Loading flowers..."):
-        image_data_list = []
+    """
+    Index of the flowers in `directory`, parsed from filenames of the form "<id>_<latin-name>_<common-name>.<ext>".
+    Only metadata is kept here (backed by the on-disk manifest, so rescans only reread files that have changed); use
+    show_image to display an image. Images added through the ingest module appear straight away, without a rescan.
+    """
+    metrics.inc("image_index_requests_total")
+    rescan_images(directory)
+    return load_image_data(directory, manifest.generation())
+
+
+@st.cache_resource(ttl="1hr", show_spinner=False)
+def rescan_images(directory: str = "images") -> int:
+    with st.spinner("Loading flowers..."), metrics.timer("image_rescan_seconds"):
+        return manifest.rescan(directory)
+
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def load_image_data(directory: str, generation: int) -> List[Dict]:
+    metrics.inc("image_index_loads_total")
+    with metrics.timer("image_index_load_seconds"):
+        return manifest.records(directory)
+
+
+def get_search_index(directory: str = "images") -> CatalogueIndex:
+    metrics.inc("search_index_requests_total")
+    rescan_images(directory)
+    return load_search_index(directory, manifest.generation())
+
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def load_search_index(directory: str, generation: int) -> CatalogueIndex:
+    metrics.inc("search_index_loads_total")
+    with metrics.timer("search_index_build_seconds"):
+        return CatalogueIndex(load_image_data(directory, generation))
+
+
+def get_similarity_index(directory: str = "images") -> SimilarityIndex:
+    metrics.inc("similarity_index_requests_total")
+    rescan_images(directory)
+    return load_similarity_index(directory, manifest.generation())
+
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def load_similarity_index(directory: str, generation: int) -> SimilarityIndex:
+    metrics.inc("similarity_index_loads_total")
+    with st.spinner("Comparing flowers..."), metrics.timer("similarity_index_build_seconds"):
+        return build_index(load_image_data(directory, generation))
+
+
+def rendition_for_width(width: int) -> str:
+    """
+    Name of the smallest rendition that is at least `width` pixels wide (or the largest rendition if none are).
+    """
+    for name, rendition_width in sorted(RENDITION_WIDTHS.items(), key=lambda r: r[1]):
+        if rendition_width >= width:
+            return name
+    return max(RENDITION_WIDTHS, key=RENDITION_WIDTHS.get)
+
+
+def get_rendition(image: Dict, rendition: str = "column") -> str:
+    """
+    Path to a resized WebP copy of an image from get_image_data, building it on first use. Renditions are named by
+    content hash, so an edited original gets new ones. Originals narrower than the rendition are re-encoded but never
+    upscaled.
+    """
+    target = rendition_path(image, rendition)
+    if not target.exists():
+        build_rendition(Path(image["path"]), target, RENDITION_WIDTHS[rendition])
+        manifest.record_derivative(image["path"], rendition, target)
+    return str(target)
+
+
+def rendition_path(image: Dict, rendition: str) -> Path:
+    return DERIVATIVE_DIR / f"{image['hash'][:16]}_{RENDITION_WIDTHS[rendition]}.webp"
+
 
-        # Create a Path object for the directory
-        dir_path = Path(directory)
+def image_url(image: Dict, rendition: str = "column") -> str:
+    """
+    URL of an image from get_image_data at the given rendition, relative to the app. Rendition filenames change with
+    the image's content, so they can be cached forever; the "v" argument is what makes the static file handler send
+    far-future cache headers.
+    """
+    path = Path(get_rendition(image, rendition))
+    if metrics.ENABLED:
+        # What a browser without the image cached downloads for it
+        metrics.inc("image_bytes_rendered_total", path.stat().st_size, rendition=rendition)
+    return f"{STATIC_URL}/{path.relative_to(STATIC_DIR).as_posix()}?v={image['hash'][:16]}"
 
-        # List all PNG, JPG, JPEG files in the directory
-        for file_path in dir_path.iterdir():
-            if file_path.suffix.lower() in [".png", ".jpg", ".jpeg"]:
-                filename = file_path.stem  # Gets the filename without the extension
 
-                # Parse the filename
-                parts = filename.split("_")
-                if len(parts) != 3:
-                    continue  # Skip files that don't match the expected format
+def show_image(image: Dict, rendition: str = "column"):
+    """
+    Display an image from get_image_data by URL, rather than passing its bytes to st.image. Browsers fetch it from the
+    static route and cache it, so its bytes never pass through streamlit's per-session media file manager.
+    """
+    size = ""
+    if image["width"] and image["height"]:
+        # Lets the browser reserve the space before the image arrives
+        width = min(image["width"], RENDITION_WIDTHS[rendition])
+        size = f' width="{width}" height="{round(image["height"] * width / image["width"])}"'
+    metrics.inc("image_urls_rendered_total", rendition=rendition)
+    st.markdown(f'<img src="{html.escape(image_url(image, rendition))}" alt="{html.escape(image["common"])}"{size} '
+                f'style="max-width: 100%; height: auto" loading="lazy">', unsafe_allow_html=True)
 
-                id_, latin, common = parts
 
-                # Read the image and convert to BytesIO
-                with open(file_path, "rb") as img_file:
-                    image_bytes = io.BytesIO(img_file.read())
+def preload_images(images: List[Dict], rendition: str = "column"):
+    """
+    Have the browser fetch images from get_image_data into its cache without displaying them, so that they appear
+    straight away when later shown with show_image.
+    """
+    tags = "".join(f'<img src="{html.escape(image_url(image, rendition))}" alt="" width="1" height="1">' for image in images)
+    st.markdown(f'<div style="position: absolute; width: 1px; height: 1px; overflow: hidden; opacity: 0" aria-hidden="true">{tags}</div>',
+                unsafe_allow_html=True)
 
-                # Create the dictionary
-                image_dict = {
-                    "id": id_,
-                    "common": common.replace("-", " ").title(),
-                    "latin": latin.replace("-", " ").title(),
-                    "image": image_bytes,
-                    "path": file_path
-                }
 
-                # Append the dictionary to the list
-                image_data_list.append(image_dict)
+def build_rendition(source: Path, target: Path, width: int):
+    with Image.open(source) as original:
+        img = ImageOps.exif_transpose(original)
+        if img.width > width:
+            img.thumbnail((width, round(img.height * width / img.width)), Image.LANCZOS)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
 
-        return image_data_list
+        # Write to a temporary file first so that concurrent sessions never read a partial rendition
+        target.parent.mkdir(parents=True, exist_ok=True)
+        temp = target.with_name(f"{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        img.save(temp, "WEBP", quality=80, method=4)
+        os.replace(temp, target)
@@ -0,0 +1,153 @@
+import hashlib
+import multiprocessing
+import os
+import re
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from PIL import ExifTags, Image, ImageOps
+
+import manifest
+import similarity
+
+# Images smaller than this on either side are rejected as unusable in the catalogue
+MIN_DIMENSION = 128
+
+FORMAT_EXTENSIONS = {"PNG": "png", "JPEG": "jpg"}
+
+
+class DuplicateImageError(ValueError):
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        super().__init__(f"Looks the same as {path}" if path else "Looks the same as another image in this batch")
+
+
+def filename_part(name: str) -> str:
+    """
+    A flower name as it appears in a catalogue filename: lowercase words joined by hyphens, with nothing that could be
+    mistaken for the "_" field separator.
+    """
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
+
+
+def prepare_image(data: bytes) -> Dict:
+    """
+    Decode and validate an image, normalising its EXIF orientation into the pixels. Returns the bytes to store (the
+    original bytes, unless they needed re-encoding), their extension, content hash, dimensions and visual features.
+    Runs in worker processes, so must only depend on its argument.
+    """
+    with Image.open(BytesIO(data)) as img:
+        img.load()
+        # exif_transpose copies the image even when there's nothing to do, so check for a rotation first
+        rotated = img.getexif().get(ExifTags.Base.Orientation) not in (None, 1)
+        transposed = ImageOps.exif_transpose(img) if rotated else img
+        if transposed.width < MIN_DIMENSION or transposed.height < MIN_DIMENSION:
+            raise ValueError(f"Image is too small ({transposed.width}x{transposed.height})")
+
+        extension = FORMAT_EXTENSIONS.get(img.format)
+        if rotated or extension is None:
+            # Rotated or in a format the catalogue doesn't read: store re-encoded pixels instead
+            extension = "jpg" if img.format == "JPEG" else "png"
+            encoded = BytesIO()
+            if extension == "jpg":
+                transposed.convert("RGB").save(encoded, "JPEG", quality=92)
+            else:
+                transposed.save(encoded, "PNG")
+            data = encoded.getvalue()
+
+        return {"data": data, "extension": extension, "hash": hashlib.sha256(data).hexdigest(),
+                "width": transposed.width, "height": transposed.height, "features": similarity.features_of(transposed)}
+
+
+def _prepare_or_error(data: bytes):
+    try:
+        return prepare_image(data)
+    except Exception as e:
+        return e
+
+
+def next_free_id(directory: str) -> int:
+    ids = [int(parsed[0]) for entry in os.scandir(directory)
+           if (parsed := manifest.parse_filename(os.path.splitext(entry.name)[0])) and parsed[0].isdigit()]
+    return max(ids, default=0) + 1
+
+
+def flag_duplicates(prepared: List, directory: str, max_workers: Optional[int] = None):
+    """
+    Replace the prepared images that look like one already in `directory`, or like an earlier one in the same batch,
+    with a DuplicateImageError.
+    """
+    candidates = [i for i, result in enumerate(prepared) if not isinstance(result, Exception)]
+    if not candidates:
+        return
+    features = [prepared[i]["features"] for i in candidates]
+    library = similarity.build_index(manifest.records(directory), max_workers)
+    within_batch = similarity.look_alike(*similarity.feature_arrays(features), *similarity.feature_arrays(features))
+    accepted = []
+    for position, (i, matches) in enumerate(zip(candidates, library.duplicates(features))):
+        if matches:
+            prepared[i] = DuplicateImageError(str(matches[0]["path"]))
+        elif within_batch[position, accepted].any():
+            prepared[i] = DuplicateImageError()
+        else:
+            accepted.append(position)
+
+
+def ingest_images(images: List[Tuple[bytes, Dict[str, str]]], directory: str = "images", max_workers: Optional[int] = None,
+                  allow_duplicates: bool = False) -> List[Tuple[Dict[str, str], Optional[str], Optional[Exception]]]:
+    """
+    Add generated images (with their flower's "latin" and "common" names) to the catalogue in `directory`. Images are
+    decoded and validated on a process pool, then written under temporary names; only once every file is complete are
+    they given the next free ids and renamed into place, and recorded in the manifest, all under the library lock. So
+    live sessions see either none or all of the batch, and pick it up without a rescan. Unless `allow_duplicates`,
+    images that look like one already in the catalogue (or earlier in the batch) are rejected with DuplicateImageError;
+    the manifest is brought up to date first, since the app may not have scanned `directory` yet (e.g. when run from
+    batch_generate.py).
+    Returns (flower, path, error) per image, in order, with either the new path or the reason it was rejected.
+    """
+    if not images:
+        return []
+    if not allow_duplicates:
+        manifest.rescan(directory)
+    workers = min(max_workers or os.cpu_count() or 1, len(images))
+    # Spawned rather than forked, since the streamlit server process has threads of its own
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        prepared = list(executor.map(_prepare_or_error, [data for data, _ in images]))
+    if not allow_duplicates:
+        flag_duplicates(prepared, directory, max_workers)
+
+    staged = []
+    try:
+        for i, ((_, flower), result) in enumerate(zip(images, prepared)):
+            if isinstance(result, Exception):
+                continue
+            if not filename_part(flower.get("latin", "")) or not filename_part(flower.get("common", "")):
+                prepared[i] = ValueError("Flower needs both a latin and a common name")
+                continue
+            temp = Path(directory) / f".ingest-{uuid.uuid4().hex}.tmp"
+            with open(temp, "wb") as f:
+                f.write(result["data"])
+                f.flush()
+                os.fsync(f.fileno())
+            staged.append((i, temp))
+
+        paths = {}
+        with manifest.library_lock(directory):
+            rows = []
+            for image_id, (i, temp) in enumerate(staged, next_free_id(directory)):
+                flower, result = images[i][1], prepared[i]
+                path = os.path.join(directory, f"{image_id}_{filename_part(flower['latin'])}_{filename_part(flower['common'])}.{result['extension']}")
+                os.replace(temp, path)
+                paths[i] = path
+                rows.append(manifest.image_row(path, directory, os.stat(path), result["hash"], result["width"], result["height"]))
+            manifest.add_images(rows)
+        manifest.record_features([(prepared[i]["hash"], *similarity.encode_features(prepared[i]["features"])) for i in paths])
+    finally:
+        for _, temp in staged:
+            temp.unlink(missing_ok=True)
+
+    return [(flower, paths.get(i), result if isinstance(result, Exception) else None)
+            for i, ((_, flower), result) in enumerate(zip(images, prepared))]
@@ -0,0 +1,33 @@
+import importlib
+import sys
+import time
+from types import ModuleType
+
+import metrics
+
+
+class LazyModule(ModuleType):
+    """
+    Stand-in for a module that is only imported when one of its attributes is first used, so that pages that never
+    use it don't pay for importing it. Importing is left to importlib, which makes it safe for concurrent sessions.
+    Names from the module can't be imported with "from ... import", as that would use them straight away; refer to
+    them through the module instead, and import them for annotations under TYPE_CHECKING.
+    """
+
+    def __getattr__(self, attr: str):
+        # Even if it's in sys.modules, another thread may still be importing it, which import_module waits for
+        imported = self.__name__ in sys.modules
+        started = time.perf_counter()
+        module = importlib.import_module(self.__name__)
+        if not imported:
+            metrics.observe("lazy_import_seconds", time.perf_counter() - started, module=self.__name__)
+        value = getattr(module, attr)
+        setattr(self, attr, value)  # So that later uses don't come through here
+        return value
+
+
+def lazy_import(name: str) -> ModuleType:
+    """
+    The module called `name` if it's already imported, otherwise a LazyModule for it.
+    """
+    return sys.modules.get(name) or LazyModule(name)
@@ -0,0 +1,217 @@
+import fcntl
+import hashlib
+import os
+import sqlite3
+from contextlib import closing, contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+MANIFEST_PATH = Path(".cache") / "manifest.sqlite"
+IMAGE_SUFFIXES = [".png", ".jpg", ".jpeg"]
+
+# Values bound per "IN (...)" query, to stay under SQLite's limit on query parameters
+QUERY_CHUNK_SIZE = 500
+
+# EXIF orientations that rotate the image by 90 degrees, so displayed width and height are swapped
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    id TEXT NOT NULL,
+    latin TEXT NOT NULL,
+    common TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    width INTEGER,
+    height INTEGER
+);
+CREATE INDEX IF NOT EXISTS images_directory ON images (directory);
+CREATE TABLE IF NOT EXISTS derivatives (
+    path TEXT NOT NULL,
+    rendition TEXT NOT NULL,
+    derivative_path TEXT NOT NULL,
+    PRIMARY KEY (path, rendition)
+);
+CREATE TABLE IF NOT EXISTS features (
+    hash TEXT PRIMARY KEY,
+    dhash BLOB NOT NULL,
+    embedding BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+def connect(manifest_path: Path = MANIFEST_PATH) -> sqlite3.Connection:
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(manifest_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+@contextmanager
+def library_lock(directory: str = "images", manifest_path: Path = MANIFEST_PATH):
+    """
+    Exclusive lock over changes to `directory` and its manifest rows, shared between processes. Held by rescans and
+    ingests so that a rescan never sees a batch of new images half written.
+    """
+    lock_path = manifest_path.parent / f"{Path(directory).resolve().name}.lock"
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def image_row(path: str, directory: str, stat: os.stat_result, hash_: str, width: Optional[int], height: Optional[int]) -> Tuple:
+    id_, latin, common = parse_filename(Path(path).stem)
+    return path, directory, id_, latin, common, stat.st_size, stat.st_mtime_ns, hash_, width, height
+
+
+def parse_filename(filename: str) -> Optional[Tuple[str, str, str]]:
+    """
+    Parse a filename stem of the form "<id>_<latin-name>_<common-name>" into (id, latin, common), or None if it
+    doesn't match.
+    """
+    parts = filename.split("_")
+    if len(parts) != 3:
+        return None
+    id_, latin, common = parts
+    return id_, latin.replace("-", " ").title(), common.replace("-", " ").title()
+
+
+def file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def image_dimensions(path: Path) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Displayed (width, height) of an image, after EXIF orientation. Only the header is read.
+    """
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+            if img.getexif().get(0x0112) in TRANSPOSED_ORIENTATIONS:
+                width, height = height, width
+            return width, height
+    except OSError:
+        return None, None
+
+
+def rescan(directory: str = "images", manifest_path: Path = MANIFEST_PATH) -> int:
+    """
+    Bring the manifest up to date with `directory`. Only files that are new, or whose size or mtime has changed, are
+    read; rows (and derivative files) of deleted images are removed. Returns the number of images added, changed or
+    removed.
+    """
+    with library_lock(directory, manifest_path):
+        on_disk = {}
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                stem, suffix = os.path.splitext(entry.name)
+                if entry.is_file() and suffix.lower() in IMAGE_SUFFIXES and parse_filename(stem):
+                    on_disk[os.path.join(directory, entry.name)] = entry.stat()
+
+        with closing(connect(manifest_path)) as conn:
+            known = {row["path"]: row for row in conn.execute("SELECT path, size, mtime_ns FROM images WHERE directory = ?", (directory,))}
+
+            changed = [path for path, stat in on_disk.items()
+                       if path not in known or known[path]["size"] != stat.st_size or known[path]["mtime_ns"] != stat.st_mtime_ns]
+            removed = [path for path in known if path not in on_disk]
+            if not changed and not removed:
+                return 0
+
+            rows = [image_row(path, directory, on_disk[path], file_hash(Path(path)), *image_dimensions(Path(path))) for path in changed]
+
+            with conn:
+                stale = changed + removed
+                for start in range(0, len(stale), QUERY_CHUNK_SIZE):
+                    chunk = stale[start:start + QUERY_CHUNK_SIZE]
+                    for row in conn.execute(f"SELECT derivative_path FROM derivatives WHERE path IN ({','.join('?' * len(chunk))})", chunk):
+                        Path(row["derivative_path"]).unlink(missing_ok=True)
+                conn.executemany("DELETE FROM derivatives WHERE path = ?", [(path,) for path in stale])
+                conn.executemany("DELETE FROM images WHERE path = ?", [(path,) for path in removed])
+                conn.executemany("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                bump_generation(conn)
+            return len(stale)
+
+
+def add_images(rows: List[Tuple], manifest_path: Path = MANIFEST_PATH):
+    """
+    Record images that are already known (rows built with image_row), without rescanning their directory. Callers
+    should hold library_lock.
+    """
+    with closing(connect(manifest_path)) as conn, conn:
+        conn.executemany("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        bump_generation(conn)
+
+
+def bump_generation(conn: sqlite3.Connection):
+    conn.execute("INSERT INTO meta VALUES ('generation', 1) ON CONFLICT (key) DO UPDATE SET value = value + 1")
+
+
+def generation(manifest_path: Path = MANIFEST_PATH) -> int:
+    """
+    Counter that increases whenever the manifest's contents change.
+    """
+    try:
+        # A plain connection, since this is checked on every rerun and the schema will already exist
+        with closing(sqlite3.connect(manifest_path, timeout=30)) as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+            return row[0] if row else 0
+    except sqlite3.OperationalError:
+        return 0
+
+
+def records(directory: str = "images", manifest_path: Path = MANIFEST_PATH) -> List[Dict]:
+    with closing(connect(manifest_path)) as conn:
+        return [{
+            "id": row["id"],
+            "common": row["common"],
+            "latin": row["latin"],
+            "path": Path(row["path"]),
+            "size": row["size"],
+            "mtime": row["mtime_ns"] / 1e9,
+            "hash": row["hash"],
+            "width": row["width"],
+            "height": row["height"],
+        } for row in conn.execute("SELECT * FROM images WHERE directory = ? ORDER BY path", (directory,))]
+
+
+def record_derivative(path: Path, rendition: str, derivative_path: Path, manifest_path: Path = MANIFEST_PATH):
+    with closing(connect(manifest_path)) as conn, conn:
+        conn.execute("INSERT OR REPLACE INTO derivatives VALUES (?, ?, ?)", (str(path), rendition, str(derivative_path)))
+
+
+def features(hashes: List[str], manifest_path: Path = MANIFEST_PATH) -> Dict[str, Tuple[bytes, bytes]]:
+    """
+    Stored visual features (see the similarity module) of the images with the given content hashes, as
+    {hash: (dhash, embedding)} for those that have them.
+    """
+    found = {}
+    with closing(connect(manifest_path)) as conn:
+        for start in range(0, len(hashes), QUERY_CHUNK_SIZE):
+            chunk = hashes[start:start + QUERY_CHUNK_SIZE]
+            rows = conn.execute(f"SELECT hash, dhash, embedding FROM features WHERE hash IN ({','.join('?' * len(chunk))})", chunk)
+            found.update((row["hash"], (row["dhash"], row["embedding"])) for row in rows)
+    return found
+
+
+def record_features(rows: List[Tuple[str, bytes, bytes]], manifest_path: Path = MANIFEST_PATH):
+    with closing(connect(manifest_path)) as conn, conn:
+        conn.executemany("INSERT OR REPLACE INTO features VALUES (?, ?, ?)", rows)
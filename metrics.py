@@ -0,0 +1,171 @@
+"""
+Process-wide counters and timers for the app's hot paths.
+
+Collection is off unless FLORMEMORU_METRICS names a sink, in which case everything recorded is flushed there every
+FLORMEMORU_METRICS_INTERVAL seconds (default 10) by a background thread:
+
+    prometheus:<path>   the current totals, rewritten atomically in Prometheus text format (for a node exporter's
+                        textfile collector, or any scraper that can read a file)
+    jsonl:<path>        one JSON object per observation, appended (for tailing)
+
+Counters are named *_total. Timers are recorded as summaries: <name>_count and <name>_sum, in seconds. Cache hit rates
+come from pairs of counters, e.g. image_index_requests_total and image_index_loads_total.
+When disabled, inc() and observe() return immediately and timer() returns a shared no-op timer.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Tuple
+
+SINK = os.environ.get("FLORMEMORU_METRICS", "")
+FLUSH_INTERVAL = float(os.environ.get("FLORMEMORU_METRICS_INTERVAL", "10"))
+ENABLED = bool(SINK)
+
+LabelKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+class Registry:
+    def __init__(self, keep_events: bool = False):
+        self.counters: Dict[LabelKey, float] = defaultdict(float)
+        self.summaries: Dict[LabelKey, list] = defaultdict(lambda: [0, 0.0])
+        self.keep_events = keep_events
+        self.events = []
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float, labels: Dict[str, str]):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] += value
+            if self.keep_events:
+                self.events.append({"ts": time.time(), "type": "counter", "name": name, "labels": labels, "value": value})
+
+    def observe(self, name: str, seconds: float, labels: Dict[str, str]):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            summary = self.summaries[key]
+            summary[0] += 1
+            summary[1] += seconds
+            if self.keep_events:
+                self.events.append({"ts": time.time(), "type": "timer", "name": name, "labels": labels, "value": seconds})
+
+    def take_events(self) -> list:
+        with self._lock:
+            events, self.events = self.events, []
+        return events
+
+    def prometheus_text(self) -> str:
+        with self._lock:
+            counters = dict(self.counters)
+            summaries = {key: tuple(value) for key, value in self.summaries.items()}
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {name} counter")
+            lines += [f"{name}{format_labels(labels)} {value}" for (n, labels), value in counters.items() if n == name]
+        for name in sorted({name for name, _ in summaries}):
+            lines.append(f"# TYPE {name} summary")
+            for (n, labels), (count, total) in summaries.items():
+                if n == name:
+                    lines.append(f"{name}_count{format_labels(labels)} {count}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {total}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = (f'{k}="{escape_label(str(v))}"' for k, v in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Timer:
+    """
+    Records the seconds between its creation and stop() (or the end of a with block) as an observation of `name`.
+    """
+    __slots__ = ("name", "labels", "start", "stopped")
+
+    def __init__(self, name: str, labels: Dict[str, str]):
+        self.name = name
+        self.labels = labels
+        self.start = time.perf_counter()
+        self.stopped = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stop(self):
+        if not self.stopped:
+            self.stopped = True
+            registry.observe(self.name, time.perf_counter() - self.start, self.labels)
+
+
+class NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def stop(self):
+        pass
+
+
+NULL_TIMER = NullTimer()
+registry = Registry(keep_events=SINK.startswith("jsonl:"))
+
+
+def inc(name: str, value: float = 1, **labels):
+    if not ENABLED:
+        return
+    registry.inc(name, value, labels)
+
+
+def observe(name: str, seconds: float, **labels):
+    if not ENABLED:
+        return
+    registry.observe(name, seconds, labels)
+
+
+def timer(name: str, **labels):
+    if not ENABLED:
+        return NULL_TIMER
+    return Timer(name, labels)
+
+
+def flush():
+    kind, _, path = SINK.partition(":")
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if kind == "prometheus":
+        temp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        temp.write_text(registry.prometheus_text())
+        os.replace(temp, path)
+    elif kind == "jsonl":
+        if events := registry.take_events():
+            with open(path, "a") as f:
+                f.writelines(json.dumps(event) + "\n" for event in events)
+    else:
+        raise ValueError(f"Unknown metrics sink: {SINK}")
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        flush()
+
+
+if ENABLED:
+    threading.Thread(target=_flush_periodically, name="metrics-flush", daemon=True).start()
+    atexit.register(flush)
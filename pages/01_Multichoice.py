@@ -1,29 +1,62 @@
 import random
-import time
 
 import streamlit as st
-from streamlithelpers import SessionObject
+from streamlithelpers import SessionObject, get_state, set_state
 
-from images import get_image_data
+import metrics
+from images import get_image_data, get_similarity_index, preload_images, rendition_for_width, show_image, WIDE_LAYOUT_WIDTH
+from progress import get_scheduler
+from settings import learner, learner_name
 
 st.set_page_config(page_title="Multichoice", layout="wide", page_icon=":blossom:")
 
+rerun_timer = metrics.timer("page_rerun_seconds", page="Multichoice")
+
 MODE_IMAGE_COMMON = "image (by common name)"
 MODE_IMAGE_LATIN = "image (by latin name)"
 MODE_TEXT_COMMON = "common name"
 MODE_TEXT_LATIN = "latin name"
 
 
+def draw_round(image_data, scheduler, previous=None):
+    correct_answer = scheduler.next_image(exclude=[previous["id"]] if previous else ()) or scheduler.next_image()
+    # In hard mode, the flowers that look most like the answer
+    distractors = get_similarity_index().nearest([correct_answer["id"]], choice_size - 1)[0] if hard_mode else []
+    if not distractors:
+        distractors = [image for image in random.sample(image_data, choice_size) if image["id"] != correct_answer["id"]]
+    answers = distractors[:choice_size - 1] + [correct_answer]
+    random.shuffle(answers)
+    return answers, answers.index(correct_answer)
+
+
+def round_key(previous=None):
+    """
+    What a round drawn in advance depends on, so that it's only used if none of it has changed.
+    """
+    return learner.get(), choice_size, hard_mode, previous["id"] if previous else None
+
+
 @SessionObject("setup")
-def current_setup(image_data):
-    answers = random.sample(image_data, choice_size)
-    correct_answer_idx = random.choice(range(len(answers)))
-    return answers, correct_answer_idx
+def current_setup(image_data, scheduler, previous=None):
+    upcoming = upcoming_setup.get()
+    upcoming_setup.clear()
+    set_state("setup_graded", False)
+    if upcoming and upcoming[0] == round_key(previous):
+        return upcoming[1]
+    return draw_round(image_data, scheduler, previous)
+
+
+@SessionObject("upcoming_setup")
+def upcoming_setup(image_data, scheduler, previous):
+    return round_key(previous), draw_round(image_data, scheduler, previous)
 
 
 image_data = get_image_data()
 n = len(image_data)
 
+learner(learner_name(st.sidebar.text_input("Learner", value=learner_name.get() or "", key="learner_input", placeholder="Guest", help="Enter a name to keep your progress between visits")))
+scheduler = get_scheduler(learner.get(), image_data)
+
 st.title("Choose the correct flower")
 
 mode_col, options_n_col = st.columns(2, gap="large")
@@ -33,9 +66,10 @@ with mode_col:
 
 with options_n_col:
     choice_size = st.slider("Choices", value=min(n, 4), min_value=2, max_value=n)
+    hard_mode = st.toggle("Hard mode", help="Choose from flowers that look alike")
 
 if st.button("Start", use_container_width=True, type="primary"):
-    current_setup(image_data)
+    current_setup(image_data, scheduler)
 
 if setup := current_setup.get():
     answers, correct_answer_idx = setup
@@ -52,31 +86,48 @@ if setup := current_setup.get():
 
     num_cols = min(5, choice_size) if mode in [MODE_IMAGE_COMMON, MODE_IMAGE_LATIN] else 2
     choice_cols = st.columns(num_cols)
+    rendition = rendition_for_width(WIDE_LAYOUT_WIDTH // num_cols)
 
     if mode in [MODE_TEXT_COMMON, MODE_TEXT_LATIN]:
         with choice_cols[1]:
-            st.image(correct_answer["image"])
+            show_image(correct_answer, rendition)
 
     status = st.empty()
+    if flash := get_state("multichoice_flash"):
+        # Feedback on the previous round, shown with this one rather than holding up the rerun
+        status.success(flash)
+        set_state("multichoice_flash", None)
 
     for i, answer in enumerate(answers):
         col = choice_cols[i % num_cols] if mode in [MODE_IMAGE_COMMON, MODE_IMAGE_LATIN] else choice_cols[0]
         with col:
             if mode == MODE_IMAGE_COMMON or mode == MODE_IMAGE_LATIN:
-                st.image(answer["image"])
+                show_image(answer, rendition)
 
             name = answer["latin"] if mode == MODE_TEXT_LATIN else answer["common"]
 
             button_name = "Choose" if mode in [MODE_IMAGE_COMMON, MODE_IMAGE_LATIN] else name
 
             if st.button(button_name, key=f"choice_button_{i}", use_container_width=True):
+                if not get_state("setup_graded"):
+                    # Only the first choice of a round counts towards the schedule
+                    scheduler.record(correct_answer["id"], 5 if i == correct_answer_idx else 1)
+                    set_state("setup_graded", True)
                 if i == correct_answer_idx:
                     st.toast("Correct! :white_check_mark:")
-                    status.success("Well done!")
-                    current_setup(image_data)
-                    time.sleep(0.7)
+                    set_state("multichoice_flash", "Well done!")
+                    current_setup(image_data, scheduler, correct_answer)
+                    rerun_timer.stop()
                     st.rerun()
                 else:
                     status.warning("Try again!")
                     st.toast("Wrong! :repeat:")
 
+    # Draw the next round now, and have the browser fetch its images while this one is being answered
+    upcoming = upcoming_setup.get()
+    if not upcoming or upcoming[0] != round_key(correct_answer):
+        upcoming = upcoming_setup(image_data, scheduler, correct_answer)
+    upcoming_answers, upcoming_idx = upcoming[1]
+    preload_images(upcoming_answers if mode in [MODE_IMAGE_COMMON, MODE_IMAGE_LATIN] else [upcoming_answers[upcoming_idx]], rendition)
+
+rerun_timer.stop()
@@ -1,14 +1,18 @@
 import random
-import time
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 import streamlit as st
-from streamlithelpers import SessionObject
+from streamlithelpers import SessionObject, get_state, set_state
 
-from images import get_image_data
+import metrics
+from images import get_image_data, preload_images, rendition_for_width, show_image, CENTERED_LAYOUT_WIDTH
+from progress import get_scheduler
+from settings import learner, learner_name
 
 st.set_page_config(page_title="Spelling", page_icon=":blossom:", layout="centered")
 
+rerun_timer = metrics.timer("page_rerun_seconds", page="Spelling")
+
 MODE_COMMON = "common name"
 MODE_LATIN = "latin name"
 
@@ -23,6 +27,28 @@ def current_revealed(r: Optional[List[int]]) -> Optional[List[int]]:
     return r
 
 
+@SessionObject("upcoming_spelling_flower")
+def upcoming_flower(scheduler, previous: Optional[Dict]) -> Tuple[Tuple, Dict]:
+    return flower_key(previous), draw_flower(scheduler, previous)
+
+
+def flower_key(previous: Optional[Dict]) -> Tuple:
+    return learner.get(), previous["id"] if previous else None
+
+
+def draw_flower(scheduler, previous: Optional[Dict] = None) -> Dict:
+    return scheduler.next_image(exclude=[previous["id"]] if previous else ()) or scheduler.next_image()
+
+
+def next_flower(scheduler, previous=None):
+    # The flower drawn in advance, if it was drawn for this one
+    upcoming = upcoming_flower.get()
+    current_flower(upcoming[1] if upcoming and upcoming[0] == flower_key(previous) else draw_flower(scheduler, previous))
+    upcoming_flower.clear()
+    current_revealed([])
+    set_state("spelling_graded", False)
+
+
 def reveal_letter(name):
     revealed = current_revealed.get()
     if len(revealed) == len(name):
@@ -37,17 +63,23 @@ current_revealed.init([])
 
 image_data = get_image_data()
 
+learner(learner_name(st.sidebar.text_input("Learner", value=learner_name.get() or "", key="learner_input", placeholder="Guest", help="Enter a name to keep your progress between visits")))
+scheduler = get_scheduler(learner.get(), image_data)
+
 st.title("Spell the flower")
 
 mode = st.selectbox("Mode", options=[MODE_COMMON, MODE_LATIN])
 
 if st.button("Begin", use_container_width=True, type="primary"):
-    current_flower(random.choice(image_data))
-    current_revealed([])
+    next_flower(scheduler)
 
 if flower := current_flower.get():
+    if flash := get_state("spelling_flash"):
+        # Feedback on the previous flower, shown with this one rather than holding up the rerun
+        st.success(flash)
+        set_state("spelling_flash", None)
     st.header(f"How do you spell the {mode} of the following flower?")
-    st.image(flower["image"])
+    show_image(flower, rendition_for_width(CENTERED_LAYOUT_WIDTH))
 
     name = flower["common"] if mode == MODE_COMMON else flower["latin"]
 
@@ -69,13 +101,25 @@ if flower := current_flower.get():
     answer = st.text_input("Answer")
 
     if st.button("Submit", disabled=not answer, use_container_width=True):
-        if answer.strip().lower() == name.lower():
+        correct = answer.strip().lower() == name.lower()
+        if not get_state("spelling_graded"):
+            # Only the first answer counts towards the schedule, less for each letter revealed
+            scheduler.record(flower["id"], 5 - min(len(revealed), 2) if correct else 1)
+            set_state("spelling_graded", True)
+        if correct:
             st.toast("Correct! :white_check_mark:")
-            st.success("Well done!")
-            time.sleep(0.7)
-            current_flower(random.choice(image_data))
-            current_revealed([])
+            set_state("spelling_flash", "Well done!")
+            next_flower(scheduler, flower)
+            rerun_timer.stop()
             st.rerun()
         else:
             st.toast("Wrong! :repeat:")
             st.warning("Try again!")
+
+    # Draw the next flower now, and have the browser fetch its image while this one is being spelt
+    upcoming = upcoming_flower.get()
+    if not upcoming or upcoming[0] != flower_key(flower):
+        upcoming = upcoming_flower(scheduler, flower)
+    preload_images([upcoming[1]], rendition_for_width(CENTERED_LAYOUT_WIDTH))
+
+rerun_timer.stop()
@@ -1,12 +1,15 @@
-import random
-
 import streamlit as st
 from streamlithelpers import SessionObject, get_state, set_state
 
-from images import get_image_data
+import metrics
+from images import get_image_data, rendition_for_width, show_image, CENTERED_LAYOUT_WIDTH
+from progress import get_scheduler
+from settings import learner, learner_name
 
 st.set_page_config(page_title="Guess", page_icon=":blossom:", layout="centered")
 
+rerun_timer = metrics.timer("page_rerun_seconds", page="Guess")
+
 
 @SessionObject("current_guess_image")
 def current_image(img):
@@ -15,17 +18,34 @@ def current_image(img):
 
 image_data = get_image_data()
 
+learner(learner_name(st.sidebar.text_input("Learner", value=learner_name.get() or "", key="learner_input", placeholder="Guest", help="Enter a name to keep your progress between visits")))
+scheduler = get_scheduler(learner.get(), image_data)
+
 st.title("Guess the flower")
 
 if st.button("Guess!", use_container_width=True, type="primary"):
-    current_image(random.choice(image_data))
+    previous = current_image.get()
+    current_image(scheduler.next_image(exclude=[previous["id"]] if previous else ()) or scheduler.next_image())
     set_state("answer_toggle", False)
+    set_state("guess_graded", False)
 
 if image_dict := current_image.get():
 
-    st.image(image_dict["image"])
+    show_image(image_dict, rendition_for_width(CENTERED_LAYOUT_WIDTH))
 
 if st.toggle("Show answer", value=get_state("answer_toggle"), key="answer_toggle"):
     st.header(image_dict["common"])
     st.subheader(f"_{image_dict['latin']}_")
 
+    if not get_state("guess_graded"):
+        knew_col, forgot_col = st.columns(2)
+        with knew_col:
+            knew = st.button("I knew it", use_container_width=True)
+        with forgot_col:
+            forgot = st.button("I didn't", use_container_width=True)
+        if knew or forgot:
+            scheduler.record(image_dict["id"], 5 if knew else 1)
+            set_state("guess_graded", True)
+            st.toast("Progress saved")
+
+rerun_timer.stop()
@@ -1,42 +1,72 @@
-import base64
-import random
-import time
-from io import BytesIO
-from typing import Dict, List, Optional
+import math
+from typing import Tuple
 
 import streamlit as st
-import pandas as pd
-from PIL import Image
 from streamlithelpers import SessionObject
 
-from images import get_image_data
+import metrics
+from images import get_search_index, rendition_for_width, show_image, CENTERED_LAYOUT_WIDTH
+from search import SORT_COMMON, SORT_LATIN
 
 st.set_page_config(page_title="Catalogue", page_icon=":blossom:", layout="centered")
 
-image_data = get_image_data()
+rerun_timer = metrics.timer("page_rerun_seconds", page="Catalogue")
+
+PAGE_SIZE = 24  # Fills whole rows for 1, 2, 3, 4 and 6 columns
+
+index = get_search_index()
+
+
+@SessionObject("catalogue_page")
+def current_page(page: int) -> int:
+    return page
+
+
+@SessionObject("catalogue_query")
+def current_query(q: Tuple[str, str]) -> Tuple[str, str]:
+    return q
 
 
-@st.cache_data()
 def query(sort: str, filter: str):
-    return [i for i in sorted(image_data, key=lambda i: i["common"].lower() if sort == "common name" else i["latin"].lower())
-            if not filter or filter in i["common"].lower() or filter in i["latin"].lower()]
+    return index.search(filter, sort)
 
 
 with st.sidebar:
-    sort = st.selectbox("Sort by", options=["common name", "latin name"])
+    sort = st.selectbox("Sort by", options=[SORT_COMMON, SORT_LATIN])
     filter = st.text_input("Search")
     filter = filter if filter is None else filter.lower()
     num_col = st.slider("Columns", min_value=1, max_value=6, value=3)
 
+results = query(sort, filter)
+num_pages = max(1, math.ceil(len(results) / PAGE_SIZE))
+
+# Start from the first page whenever the search or sort changes
+if current_query.get() != (sort, filter):
+    current_query((sort, filter))
+    current_page(0)
+page = min(current_page.get() or 0, num_pages - 1)
+
 image_cols = st.columns(num_col)
+rendition = rendition_for_width(CENTERED_LAYOUT_WIDTH // num_col)
 
-for i, image in enumerate(query(sort, filter)):
+for i, image_id in enumerate(results[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]):
+    image = index.records[image_id]
     col = image_cols[i % num_col]
     with col:
         st.write(image["common"])
         st.caption(image["latin"])
-        st.image(image["image"])
+        show_image(image, rendition)
 
     if i % num_col == num_col-1:
         image_cols = st.columns(num_col)
 
+
+prev_col, page_col, next_col = st.columns([1, 2, 1])
+with prev_col:
+    st.button("Previous", disabled=page == 0, on_click=current_page, args=(page - 1,), use_container_width=True)
+with page_col:
+    st.caption(f"Page {page + 1} of {num_pages} ({len(results)} flowers)")
+with next_col:
+    st.button("Next", disabled=page >= num_pages - 1, on_click=current_page, args=(page + 1,), use_container_width=True)
+
+rerun_timer.stop()
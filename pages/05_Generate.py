@@ -1,59 +1,156 @@
-import os
 import zipfile
-from typing import Dict, List
+from io import BytesIO
+from typing import Dict, List, Tuple
 
 import streamlit as st
-from PIL import Image
-from streamlit_extras.switch_page_button import switch_page
-from streamlithelpers import SessionObject
+from streamlithelpers import SessionObject, set_state
 
-from chat import stream_json, generate_images, OpenAiCompletionParameters, list_models
+import client_pool
+import metrics
+from chat import stream_json, add_unique_items, generate_json_items, generate_image_batch, items_per_request, ImagePipeline, OpenAiCompletionParameters, list_models, DEFAULT_IMAGE_CONCURRENCY
+from flowers import EXAMPLE_FLOWER, flower_image_prompt, flower_keys, flower_names_prompt, flower_names_shard_prompt
+from ingest import ingest_images
 from settings import api_key, model, model_params
 
 st.set_page_config(page_title="Generate", page_icon=":blossom:", layout="centered")
 
+rerun_timer = metrics.timer("page_rerun_seconds", page="Generate")
 
-@SessionObject("flower_names")
-def flower_names(n: int = 20) -> List[Dict[str, str]]:
-    with st.status(f"Generating flower names..."):
-        return stream_json(f"""
-        Generate a JSON array of {n} JSON objects, where each JSON object represents a random flower.
-        Each of the {n} JSON objects should have the following 3 properties:
-        1. "latin" (string): the latin name of the flower
-        2. "common" (string): the common name of the flower.
-        3. "description" (string): a short visual description of an example of this flower.
-        Ensure that your response contains only valid JSON.
-        """, chat_model, key, chat_model_params)
 
+def fits_in_one_request(n: int) -> bool:
+    return n <= items_per_request(EXAMPLE_FLOWER, chat_model, chat_model_params.max_tokens)
 
-@SessionObject("flower_images")
-def flower_images(flowers: List[Dict[str, str]]):
-    images = []
-    for flower in flowers:
+
+@SessionObject("flower_names")
+def flower_names(n: int = 20, use_cache: bool = True) -> List[Dict[str, str]]:
+    """
+    Generate `n` different flowers. If their names fit in max_tokens they're streamed from one request, so that they
+    show up as they arrive; otherwise they're generated in as many parallel requests as it takes.
+    """
+    with st.status(f"Generating {n} flower names...") as status:
         try:
-            with st.spinner(f"Generating image for: {flower['common']} ({flower['latin']})..."):
-                generated = generate_images(f"""
-                A high quality photograph of a bunch of the following flower: 
-                {flower['common']} (latin name: {flower['latin']}). Description: {flower['description']}
-                """, 1, key, "dall-e-3")
-                images.append((generated[0], flower))
-        except:
-            st.warning(f"Error generating for: {flower['common']}. Skipped")
-            continue
+            if fits_in_one_request(n):
+                flowers = add_unique_items(stream_json(flower_names_prompt(n), chat_model, key, chat_model_params, use_cache=use_cache), flower_keys, [], set())
+            else:
+                progress = st.progress(0.0)
+                flowers = generate_json_items(n, flower_names_shard_prompt, flower_keys, EXAMPLE_FLOWER, chat_model, key, chat_model_params,
+                                              use_cache=use_cache, on_progress=lambda count: progress.progress(count / n, text=f"{count}/{n}"))
+                st.json(flowers, expanded=False)
+        except Exception as e:
+            st.error(f"Couldn't generate flower names: {e}")
+            status.update(label="Couldn't generate flower names", state="error")
+            return []
+        status.update(label=f"Generated {len(flowers)} flower names", state="complete")
+    return flowers
 
-    return images
+
+@SessionObject("flower_images")
+def flower_images(flowers: List[Dict[str, str]], concurrency: int = DEFAULT_IMAGE_CONCURRENCY, use_cache: bool = True):
+    generated = {}
+    with st.status(f"Generating {len(flowers)} images...") as status:
+        progress = st.progress(0.0)
+        prompts = [flower_image_prompt(flower) for flower in flowers]
+        for done, (i, image) in enumerate(generate_image_batch(prompts, key, "dall-e-3", max_workers=concurrency, use_cache=use_cache), 1):
+            flower = flowers[i]
+            if isinstance(image, Exception):
+                st.warning(f"Error generating for: {flower['common']}. Skipped")
+            else:
+                generated[i] = image
+                st.write(f"Generated image for: {flower['common']} ({flower['latin']})")
+            progress.progress(done / len(flowers), text=f"{done}/{len(flowers)}")
+        status.update(label=f"Generated {len(generated)} of {len(flowers)} images", state="complete")
+
+    return [(generated[i], flowers[i]) for i in sorted(generated)]
+
+
+def flower_library(n: int, concurrency: int = DEFAULT_IMAGE_CONCURRENCY, use_cache: bool = True):
+    """
+    Generate flower names and their images in one pipelined pass: each flower's image request starts as soon as the
+    flower has been streamed (or, for any that couldn't be parsed from the stream, once the full response has been
+    repaired), and images are shown as they finish. If the names don't fit in one request, they're generated in
+    parallel shards as in flower_names, and each shard's flowers are sent for images as soon as it finishes. Stores the
+    results as flower_names and flower_images.
+    """
+    flowers = []
+    generated = {}
+    with st.status(f"Generating flower library...") as status:
+        names = st.empty()
+        image_cols = st.columns(5)
+
+        def show(results):
+            for i, image in results:
+                if isinstance(image, Exception):
+                    st.warning(f"Error generating for: {flowers[i]['common']}. Skipped")
+                else:
+                    image_cols[len(generated) % len(image_cols)].image(image, caption=f"{flowers[i]['common']} ({flowers[i]['latin']})")
+                    generated[i] = image
+
+        with ImagePipeline(key, "dall-e-3", max_workers=concurrency, max_pending=concurrency, use_cache=use_cache) as pipeline:
+            def on_flower(flower: Dict[str, str]):
+                flowers.append(flower)
+                pipeline.submit(flower_image_prompt(flower))
+                show(pipeline.completed())
+
+            def on_flowers(shard_flowers: List[Dict[str, str]]):
+                for flower in shard_flowers:
+                    on_flower(flower)
+
+            if fits_in_one_request(n):
+                result = stream_json(flower_names_prompt(n), chat_model, key, chat_model_params, container=names, use_cache=use_cache, on_item=on_flower)
+                # Flowers the stream parser couldn't read on their own (such as a truncated last one) only appear once
+                # the whole response has been repaired
+                streamed = {flower_key for flower in flowers for flower_key in flower_keys(flower)}
+                for flower in add_unique_items(result, flower_keys, [], streamed):
+                    on_flower(flower)
+            else:
+                progress = names.progress(0.0, text=f"Naming {n} flowers...")
+                generate_json_items(n, flower_names_shard_prompt, flower_keys, EXAMPLE_FLOWER, chat_model, key, chat_model_params, use_cache=use_cache,
+                                    on_progress=lambda count: progress.progress(count / n, text=f"{count}/{n} flowers named"),
+                                    on_items=on_flowers)
+            status.update(label=f"Generating images for {len(flowers)} flowers...")
+            show(pipeline.wait())
+
+        status.update(label=f"Generated {len(generated)} of {len(flowers)} images", state="complete")
+
+    set_state("flower_names", flowers)
+    set_state("flower_images", [(generated[i], flowers[i]) for i in sorted(generated)])
 
 
 def clean_name(name: str) -> str:
     return name.replace(" ", "-").lower().strip()
 
 
+def zip_images(images: List[Tuple[BytesIO, Dict[str, str]]]) -> BytesIO:
+    """
+    In-memory ZIP of the generated images, written from their already-encoded bytes. Entries are stored rather than
+    deflated, since the images are compressed already.
+    """
+    archive = BytesIO()
+    with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_STORED) as zipf:
+        for i, (image, flower) in enumerate(images):
+            data = image.getvalue()
+            zipf.writestr(f'{i}_{clean_name(flower["common"])}_{clean_name(flower["latin"])}.{image_extension(data)}', data)
+    archive.seek(0)
+    return archive
+
+
+def image_extension(data: bytes) -> str:
+    if data.startswith(b"\xff\xd8"):
+        return "jpg"
+    elif data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return "png"
+
+
 try:
     if st.secrets.load_if_toml_exists() and "openai_key" in st.secrets:
         api_key(st.secrets["openai_key"])
 except:
     pass  # Fails if no secrets file specified
 
+# Have a connection to the API ready by the time this session makes its first request
+client_pool.warm_up()
+
 with st.sidebar:
     if api_key_val := st.text_input("OpenAI API key", value=api_key.get() or "", key="api_key_widget", type="password", help="Specify your OpenAI API key here to access the app's tools. Visit [here](https://openai.com/blog/openai-api) to sign up for access to OpenAI's API and get your API key."):
         api_key(api_key_val)
@@ -73,6 +170,8 @@ with st.sidebar:
     with st.expander("Model parameters"):
         model_params(OpenAiCompletionParameters("model_params"))
 
+    use_cache = st.toggle("Reuse cached responses", value=True, key="use_cache_toggle", help="Answer repeated requests (same prompt, model and parameters) from the local response cache instead of calling the API again.")
+
 
 chat_model_params = model_params.get()
 chat_model = model.get()
@@ -83,15 +182,22 @@ st.header("Generate flowers")
 if key and chat_model:
 
     flower_n = st.number_input("Number of flowers to generate", value=20)
+    concurrency = st.number_input("Parallel image requests", value=DEFAULT_IMAGE_CONCURRENCY, min_value=1, max_value=16, help="How many images to generate at once. Lower this if you hit your account's rate limits.")
+
+    names_col, library_col = st.columns(2)
+    generate_names = names_col.button("Generate flowers", use_container_width=True)
+    generate_library = library_col.button("Generate library", use_container_width=True, help="Generate flowers and their images together, starting each image as soon as its flower has been named.")
 
-    if st.button("Generate flowers", use_container_width=True):
-        flower_names(flower_n)
+    if generate_names:
+        flower_names(flower_n, use_cache)
+    elif generate_library:
+        flower_library(flower_n, concurrency, use_cache)
 
     if flowers := flower_names.get():
         for flower in flowers:
             st.markdown(f"**{flower['common']}** ({flower['latin']}): {flower['description']}")
         if st.button("Generate images", use_container_width=True):
-            flower_images(flowers)
+            flower_images(flowers, concurrency, use_cache)
 
     if images := flower_images.get():
         img_cols = st.columns(min(len(images), 5))
@@ -100,24 +206,17 @@ if key and chat_model:
                 st.image(image, caption=flower["common"] + f" ({flower['latin']})")
 
         if st.button("Get download link", use_container_width=True):
-            temp_dir = 'temp_images'
-            os.makedirs(temp_dir, exist_ok=True)
-            zip_filename = "flowers.zip"
-
-            for i, (image, flower) in enumerate(images):
-                filename = f'{i}_{clean_name(flower["common"])}_{clean_name(flower["latin"])}.png'
-                img = Image.open(image)
-                img.save(os.path.join(temp_dir, filename))
-
-            with zipfile.ZipFile(zip_filename, 'w') as zipf:
-                for root, dirs, files in os.walk(temp_dir):
-                    for file in files:
-                        zipf.write(os.path.join(root, file),
-                                   os.path.relpath(os.path.join(root, file), os.path.join(temp_dir, '..')))
+            st.download_button(label='Download Images', data=zip_images(images), file_name="flowers.zip", mime='application/zip', use_container_width=True)
 
-            with open(zip_filename, 'rb') as f:
-                st.download_button(label='Download Images', data=f, file_name=zip_filename, mime='application/zip', use_container_width=True)
+        if st.button("Add to catalogue", use_container_width=True, help="Save these images into the flower library, where they can be used for practice and browsed in the catalogue."):
+            with st.spinner(f"Adding {len(images)} flowers to the catalogue..."):
+                added = ingest_images([(image.getvalue(), flower) for image, flower in images])
+            for flower, path, error in added:
+                if error is not None:
+                    st.warning(f"Couldn't add {flower['common']}: {error}")
+            st.success(f"Added {sum(path is not None for _, path, _ in added)} flowers to the catalogue")
 
 else:
     st.write("Enter your Open AI API key in the sidebar to use GPT to generate your flowers.")
 
+rerun_timer.stop()
@@ -0,0 +1,214 @@
+import atexit
+import heapq
+import queue
+import random
+import sqlite3
+import threading
+import time
+import traceback
+from contextlib import closing
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import streamlit as st
+from streamlithelpers import SessionObject
+
+from settings import is_guest
+
+PROGRESS_PATH = Path(".cache") / "progress.sqlite"
+
+# Writes are committed in batches of up to this many reviews, or whatever is queued after this many seconds
+WRITE_BATCH_SIZE = 500
+WRITE_BATCH_SECONDS = 0.25
+
+# Learning steps before a card graduates to day-scale SM-2 intervals
+RELEARN_SECONDS = 60
+FIRST_INTERVAL_SECONDS = 10 * 60
+SECOND_INTERVAL_SECONDS = 24 * 60 * 60
+DEFAULT_EASE = 2.5
+MIN_EASE = 1.3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cards (
+    learner TEXT NOT NULL,
+    flower TEXT NOT NULL,
+    due REAL NOT NULL,
+    interval REAL NOT NULL,
+    ease REAL NOT NULL,
+    reps INTEGER NOT NULL,
+    lapses INTEGER NOT NULL,
+    PRIMARY KEY (learner, flower)
+) WITHOUT ROWID;
+"""
+
+
+@dataclass
+class Card:
+    flower: str
+    due: float = 0.0
+    interval: float = 0.0  # Seconds
+    ease: float = DEFAULT_EASE
+    reps: int = 0
+    lapses: int = 0
+
+
+def review(card: Card, quality: int, now: float) -> Card:
+    """
+    SM-2 update of a card after an answer graded `quality` (0-5, where 3 or more counts as remembered), with short
+    learning steps so that new and forgotten flowers come back within the same session.
+    """
+    if quality < 3:
+        card.reps = 0
+        card.lapses += 1
+        card.interval = RELEARN_SECONDS
+    else:
+        card.reps += 1
+        if card.reps == 1:
+            card.interval = FIRST_INTERVAL_SECONDS
+        elif card.reps == 2:
+            card.interval = SECOND_INTERVAL_SECONDS
+        else:
+            card.interval *= card.ease
+    card.ease = max(MIN_EASE, card.ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    card.due = now + card.interval
+    return card
+
+
+class ProgressStore:
+    """
+    Per-learner card state in SQLite (WAL mode). Writes are queued and committed in batches by a background thread, so
+    recording an answer never waits on disk.
+    """
+
+    def __init__(self, path: Path = PROGRESS_PATH):
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+        self._queue = queue.Queue()
+        threading.Thread(target=self._write_batches, name="progress-writer", daemon=True).start()
+        atexit.register(self.flush)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def load(self, learner: str) -> Dict[str, Card]:
+        self.flush()  # So that reviews still queued from an evicted scheduler aren't lost
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT flower, due, interval, ease, reps, lapses FROM cards WHERE learner = ?", (learner,))
+            return {row[0]: Card(*row) for row in rows}
+
+    def save(self, learner: str, card: Card):
+        self._queue.put((learner, card.flower, card.due, card.interval, card.ease, card.reps, card.lapses))
+
+    def flush(self):
+        self._queue.join()
+
+    def _write_batches(self):
+        conn = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + WRITE_BATCH_SECONDS
+            while len(batch) < WRITE_BATCH_SIZE and (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                with conn:
+                    conn.executemany("INSERT OR REPLACE INTO cards VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+            except sqlite3.Error:
+                traceback.print_exc()  # Losing a batch of reviews beats stopping the writer
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+class Scheduler:
+    """
+    Spaced repetition schedule of one learner's flowers. Cards are kept in a heap by due time, so picking the next card
+    is O(log n); a card's heap entry is replaced (and the stale one skipped when reached) whenever it's reviewed.
+    Flowers the learner hasn't seen yet are due immediately, in random order. Without a `store`, the schedule is only
+    kept in memory.
+    """
+
+    def __init__(self, learner: str, store: Optional[ProgressStore]):
+        self.learner = learner
+        self.store = store
+        self.cards = store.load(learner) if store is not None else {}
+        self._library = None
+        self._images = {}
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def sync(self, image_data: List[Dict]):
+        """
+        Schedule the flowers in `image_data` (from get_image_data). Only does any work when the library has changed.
+        """
+        if image_data is self._library:
+            return
+        with self._lock:
+            self._library = image_data
+            self._images = {image["id"]: image for image in image_data}
+            for flower in self._images.keys() - self.cards.keys():
+                self.cards[flower] = Card(flower)
+            self._heap = [(card.due, random.random(), card.flower) for card in self.cards.values() if card.flower in self._images]
+            heapq.heapify(self._heap)
+
+    def next_image(self, exclude: Sequence[str] = ()) -> Optional[Dict]:
+        """
+        Image of the card due soonest (or, if none are due, the one that will be due next), other than the ids in
+        `exclude`.
+        """
+        with self._lock:
+            skipped = []
+            found = None
+            while self._heap:
+                due, tiebreak, flower = self._heap[0]
+                if flower not in self._images or self.cards[flower].due != due:
+                    heapq.heappop(self._heap)  # Stale entry
+                elif flower in exclude:
+                    skipped.append(heapq.heappop(self._heap))
+                else:
+                    found = flower
+                    break
+            for entry in skipped:
+                heapq.heappush(self._heap, entry)
+            return self._images[found] if found is not None else None
+
+    def record(self, flower: str, quality: int):
+        with self._lock:
+            card = review(self.cards.setdefault(flower, Card(flower)), quality, time.time())
+            heapq.heappush(self._heap, (card.due, random.random(), flower))
+        if self.store is not None:
+            self.store.save(self.learner, card)
+
+
+@st.cache_resource()
+def progress_store() -> ProgressStore:
+    return ProgressStore()
+
+
+@st.cache_resource(max_entries=1000)
+def learner_scheduler(learner: str) -> Scheduler:
+    return Scheduler(learner, progress_store())
+
+
+@SessionObject("guest_scheduler")
+def guest_scheduler(learner: str) -> Scheduler:
+    return Scheduler(learner, None)
+
+
+def get_scheduler(learner: str, image_data: List[Dict]) -> Scheduler:
+    """
+    `learner`'s schedule, synced with `image_data`. A guest's is kept in its session only, since nothing could read it
+    back once the session ends: storing it would only grow the store, and loading it make the first rerun wait for
+    every queued write.
+    """
+    scheduler = guest_scheduler.init(learner) if is_guest(learner) else learner_scheduler(learner)
+    scheduler.sync(image_data)
+    return scheduler
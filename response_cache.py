@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+import metrics
+
+CACHE_DIR = Path(".cache") / "responses"
+CACHE_MAX_BYTES = int(os.environ.get("FLORMEMORU_RESPONSE_CACHE_MB", "512")) * 1024 * 1024
+
+
+def cache_key(**request) -> str:
+    """
+    Content address of an API request: a hash of its parameters in canonical JSON form.
+    """
+    canonical = json.dumps(request, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent cache of API responses, stored as one file per content address. Reads refresh a file's mtime, and once
+    the total size exceeds `max_bytes` the least recently used files are evicted.
+    """
+
+    def __init__(self, directory: Path = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes = None  # Measured on first write
+
+    def path(self, key: str) -> Path:
+        return self.directory / key[:2] / key
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self.path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, data: bytes):
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp = path.with_name(f"{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+        temp.write_bytes(data)
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(f.stat().st_size for f in self._files())
+            if path.exists():
+                self._total_bytes -= path.stat().st_size
+            os.replace(temp, path)
+            self._total_bytes += len(data)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _files(self):
+        return (f for f in self.directory.glob("*/*") if not f.name.endswith(".tmp"))
+
+    def _evict(self):
+        for f in sorted(self._files(), key=lambda f: f.stat().st_mtime):
+            if self._total_bytes <= self.max_bytes:
+                break
+            size = f.stat().st_size
+            f.unlink(missing_ok=True)
+            self._total_bytes -= size
+
+
+@lru_cache(maxsize=None)
+def default_cache() -> ResponseCache:
+    return ResponseCache()
+
+
+def get(key: str) -> Optional[bytes]:
+    data = default_cache().get(key)
+    metrics.inc("response_cache_requests_total", result="miss" if data is None else "hit")
+    return data
+
+
+def put(key: str, data: bytes):
+    default_cache().put(key, data)
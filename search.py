@@ -0,0 +1,228 @@
+import threading
+from collections import Counter, OrderedDict, defaultdict
+from typing import Dict, List, Optional, Sequence, Set
+
+import metrics
+
+SORT_COMMON = "common name"
+SORT_LATIN = "latin name"
+
+# Queries up to this length are looked up directly in the n-gram index, longer ones by intersecting their trigrams
+MAX_GRAM = 3
+
+# Pick matches out of the presorted order as they're needed, rather than sorting them, once they cover this fraction of
+# the catalogue
+SCAN_FRACTION = 1 / 64
+
+# Recent queries whose results (and substring matches, which the next keystroke's are found among) are kept
+MAX_CACHED_QUERIES = 128
+
+NO_MATCHES = frozenset()
+
+
+def normalise(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def ngrams(text: str, n: int) -> Set[str]:
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def max_typos(token: str) -> int:
+    if len(token) < 4:
+        return 0
+    return 1 if len(token) < 8 else 2
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Levenshtein distance between `a` and `b`, or `limit + 1` as soon as it is known to exceed `limit`.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class SearchResults(Sequence[str]):
+    """
+    Ids of the records matching a search, in sort order, put in order only as far as they're read. Few matches are
+    sorted up front; many are picked out of the presorted order as they're needed, so the first page of a query that
+    matches most of the catalogue costs no more than the page. Safe to share between sessions.
+    """
+
+    def __init__(self, ids: List[str], matches: Set[int], order: Sequence[int], rank: List[int]):
+        self._ids = ids
+        self._matches = matches
+        self._order = order
+        self._lock = threading.Lock()
+        if len(matches) <= len(order) * SCAN_FRACTION:
+            self._found = sorted(matches, key=rank.__getitem__)
+            self._scanned = len(order)
+        else:
+            self._found = []
+            self._scanned = 0
+
+    def __len__(self):
+        return len(self._matches)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            positions = range(*item.indices(len(self)))
+            self._find(max(positions, default=-1) + 1)
+            return [self._ids[self._found[position]] for position in positions]
+        position = range(len(self))[item]
+        self._find(position + 1)
+        return self._ids[self._found[position]]
+
+    def _find(self, count: int):
+        if count <= len(self._found):
+            return
+        with self._lock:
+            while len(self._found) < count and self._scanned < len(self._order):
+                # Scan about as far as the matches' density says the rest are, with some to spare
+                length = max(256, int((count - len(self._found)) * len(self._order) / len(self._matches) * 1.25))
+                chunk = self._order[self._scanned:self._scanned + length]
+                self._found.extend(i for i in chunk if i in self._matches)
+                self._scanned += len(chunk)
+
+
+class CatalogueIndex:
+    """
+    Search index over image records from get_image_data. Orderings for each sort key are computed once, and common and
+    latin names are indexed by character n-grams (for prefix and substring matches) and by word (for typo-tolerant
+    matches). Searches return record ids in sort order (as SearchResults); look records up in `records`. Results of
+    recent queries are kept, and a query's substring matches are found among those of the last query it extends, so
+    search-as-you-type only looks at the previous keystroke's matches.
+    """
+
+    def __init__(self, image_data: List[Dict]):
+        self.records = {image["id"]: image for image in image_data}
+        self._ids = list(self.records)
+        self._texts = [normalise(image["common"]) + "\n" + normalise(image["latin"]) for image in self.records.values()]
+
+        self._orders = {}
+        self._ranks = {}
+        self._sorted_ids = {}
+        for sort, field in [(SORT_COMMON, "common"), (SORT_LATIN, "latin")]:
+            order = sorted(range(len(self._ids)), key=lambda i: self.records[self._ids[i]][field].lower())
+            self._orders[sort] = order
+            self._ranks[sort] = [0] * len(order)
+            for rank, i in enumerate(order):
+                self._ranks[sort][i] = rank
+            self._sorted_ids[sort] = tuple(self._ids[i] for i in order)
+
+        self._grams = defaultdict(set)
+        self._words = defaultdict(set)
+        for i, text in enumerate(self._texts):
+            for n in range(1, MAX_GRAM + 1):
+                for gram in ngrams(text, n):
+                    self._grams[gram].add(i)
+            for word in text.split():
+                self._words[word].add(i)
+
+        # N-grams of each distinct word: bigrams to find candidates for typo-tolerant matching, trigrams to find the
+        # words containing a query, which are far fewer than the records containing it
+        self._word_bigrams = defaultdict(set)
+        self._word_trigrams = defaultdict(set)
+        for word in self._words:
+            for gram in ngrams(word, 2):
+                self._word_bigrams[gram].add(word)
+            for gram in ngrams(word, MAX_GRAM):
+                self._word_trigrams[gram].add(word)
+
+        self._results = OrderedDict()  # (query, sort) -> SearchResults
+        self._substrings = OrderedDict()  # Query -> indexes of the records containing it
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def search(self, query: str, sort: str = SORT_COMMON) -> Sequence[str]:
+        """
+        Ids of records whose common or latin name contains `query`, in `sort` order. If nothing contains it, returns
+        records that contain each of the query's words, allowing for typos in words of 4 or more letters.
+        """
+        query = normalise(query)
+        if not query:
+            return self._sorted_ids[sort]
+        if (results := self._cached(self._results, (query, sort))) is not None:
+            metrics.inc("catalogue_queries_total", cache="hit")
+            return results
+        metrics.inc("catalogue_queries_total", cache="miss")
+        with metrics.timer("catalogue_query_seconds"):
+            matches = self._substring_matches(query) or self._word_matches(query)
+            results = SearchResults(self._ids, matches, self._orders[sort], self._ranks[sort])
+        self._remember(self._results, (query, sort), results)
+        return results
+
+    def _cached(self, cache: OrderedDict, key):
+        with self._lock:
+            if (value := cache.get(key)) is not None:
+                cache.move_to_end(key)
+            return value
+
+    def _remember(self, cache: OrderedDict, key, value):
+        with self._lock:
+            cache[key] = value
+            while len(cache) > MAX_CACHED_QUERIES:
+                cache.popitem(last=False)
+
+    def _substring_matches(self, query: str) -> Set[int]:
+        if len(query) <= MAX_GRAM:
+            return self._grams.get(query, NO_MATCHES)
+        if (matches := self._cached(self._substrings, query)) is not None:
+            return matches
+        if " " not in query:
+            # Within one word: the records containing any of the words that contain it
+            candidates = min((self._word_trigrams.get(gram, NO_MATCHES) for gram in ngrams(query, MAX_GRAM)), key=len)
+            words = [word for word in candidates if query in word]
+            matches = self._words[words[0]] if len(words) == 1 else set().union(*(self._words[word] for word in words))
+            self._remember(self._substrings, query, matches)
+            return matches
+        # Records containing the query are among those containing any of its prefixes (such as the previous
+        # keystroke's query) or its trigrams, so check the fewest of those
+        candidates = min((self._grams.get(gram, NO_MATCHES) for gram in ngrams(query, MAX_GRAM)), key=len)
+        for length in range(len(query) - 1, MAX_GRAM, -1):
+            if (prefix_matches := self._cached(self._substrings, query[:length])) is not None:
+                candidates = min(candidates, prefix_matches, key=len)
+                break
+        matches = {i for i in candidates if query in self._texts[i]}
+        self._remember(self._substrings, query, matches)
+        return matches
+
+    def _word_matches(self, query: str) -> Set[int]:
+        """
+        Records containing each word of `query`, or (for words of 4 or more letters that nothing contains) a word
+        within a few typos of it.
+        """
+        matches: Optional[Set[int]] = None
+        for token in query.split():
+            token_matches = self._substring_matches(token) or self._fuzzy_matches(token)
+            matches = token_matches if matches is None else matches & token_matches
+            if not matches:
+                return NO_MATCHES
+        return matches
+
+    def _fuzzy_matches(self, token: str) -> Set[int]:
+        limit = max_typos(token)
+        if limit == 0:
+            return NO_MATCHES
+
+        # Words within `limit` edits of the token (or of one of its prefixes, for search-as-you-type) share at least
+        # this many of its bigrams
+        shared = Counter(word for gram in ngrams(token, 2) for word in self._word_bigrams.get(gram, ()))
+        needed = len(token) - 1 - 2 * limit
+        matches = set()
+        for word, count in shared.items():
+            prefixes = {word[:len(token) + k] for k in range(-limit, limit + 1)}
+            if count >= needed and min(edit_distance(token, prefix, limit) for prefix in prefixes | {word}) <= limit:
+                matches |= self._words[word]
+        return matches
@@ -1,6 +1,11 @@
+import uuid
+from typing import TYPE_CHECKING
+
 from streamlithelpers import SessionObject
 
-from chat import OpenAiCompletionParameters
+if TYPE_CHECKING:
+    # Only for the annotation: importing chat here would make every page that uses settings import it
+    from chat import OpenAiCompletionParameters
 
 
 @SessionObject("api_key")
@@ -9,10 +14,37 @@ def api_key(key: str) -> str:
 
 
 @SessionObject("model_params")
-def model_params(params: OpenAiCompletionParameters) -> OpenAiCompletionParameters:
+def model_params(params: "OpenAiCompletionParameters") -> "OpenAiCompletionParameters":
     return params
 
 
 @SessionObject("model")
 def model(m: str) -> str:
-    return m
\ No newline at end of file
+    return m
+
+
+@SessionObject("learner_name")
+def learner_name(name: str) -> str:
+    return name
+
+
+# Prefix of the ids of anonymous learners, whose progress is only kept for their session (see progress.get_scheduler)
+GUEST_PREFIX = "guest-"
+
+
+@SessionObject("guest_learner")
+def guest_learner() -> str:
+    return f"{GUEST_PREFIX}{uuid.uuid4().hex}"
+
+
+def is_guest(learner_id: str) -> bool:
+    return learner_id.startswith(GUEST_PREFIX)
+
+
+@SessionObject("learner")
+def learner(name: str) -> str:
+    """
+    Learner whose progress is recorded: the name entered, or if there isn't one a guest id of this session's own, so
+    that anonymous users never share (and change) each other's schedules.
+    """
+    return name.strip() or guest_learner.init()
@@ -0,0 +1,174 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from PIL import Image, ImageOps
+
+import manifest
+
+# Colour histogram bins per HSV channel, and texture bins (edge orientations, then edge strengths)
+HUE_BINS, SATURATION_BINS, VALUE_BINS = 8, 3, 3
+ORIENTATION_BINS = 8
+MAGNITUDE_EDGES = [8, 32, 96]
+EMBEDDING_SIZE = HUE_BINS * SATURATION_BINS * VALUE_BINS + ORIENTATION_BINS + len(MAGNITUDE_EDGES) + 1
+
+# Side of the thumbnail features are computed from
+FEATURE_SIZE = 64
+
+# Two images are duplicates if their difference hashes differ in at most this many of 64 bits and their embeddings
+# are at least this similar
+DUPLICATE_HASH_DISTANCE = 8
+DUPLICATE_SIMILARITY = 0.9
+
+# Set bits in each byte value, for counting the bits of whole arrays at once
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+Features = Tuple[int, np.ndarray]
+
+
+def image_features(source: Union[bytes, Path, str]) -> Features:
+    """
+    Perceptual difference hash (a 64 bit int) and L2-normalised colour and texture embedding of an image, after EXIF
+    orientation. Runs in worker processes, so must only depend on its argument.
+    """
+    with Image.open(BytesIO(source) if isinstance(source, bytes) else source) as img:
+        img.draft("RGB", (FEATURE_SIZE * 2, FEATURE_SIZE * 2))  # Let JPEGs decode at a fraction of full size
+        return features_of(ImageOps.exif_transpose(img))
+
+
+def features_of(img: Image.Image) -> Features:
+    """
+    Features of an already decoded (and oriented) image.
+    """
+    img = img.convert("RGB")
+    small = img.resize((FEATURE_SIZE, FEATURE_SIZE), Image.BILINEAR)
+
+    gray = np.asarray(img.convert("L").resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    dhash = int.from_bytes(np.packbits(gray[:, 1:] > gray[:, :-1]).tobytes(), "big")
+
+    hsv = np.asarray(small.convert("HSV"), dtype=np.uint16)
+    bins = ((hsv[..., 0] * HUE_BINS // 256) * SATURATION_BINS + hsv[..., 1] * SATURATION_BINS // 256) * VALUE_BINS + hsv[..., 2] * VALUE_BINS // 256
+    colour = np.bincount(bins.ravel(), minlength=HUE_BINS * SATURATION_BINS * VALUE_BINS).astype(np.float32)
+
+    luma = np.asarray(small.convert("L"), dtype=np.float32)
+    dx, dy = luma[:-1, 1:] - luma[:-1, :-1], luma[1:, :-1] - luma[:-1, :-1]
+    magnitude = np.hypot(dx, dy).ravel()
+    orientation = ((np.arctan2(dy, dx).ravel() % np.pi) / np.pi * ORIENTATION_BINS).astype(np.intp) % ORIENTATION_BINS
+    texture = np.concatenate([
+        np.bincount(orientation, weights=magnitude, minlength=ORIENTATION_BINS),
+        np.bincount(np.searchsorted(MAGNITUDE_EDGES, magnitude), minlength=len(MAGNITUDE_EDGES) + 1),
+    ]).astype(np.float32)
+
+    # Square roots of the normalised histograms, so that dot products compare them like the Hellinger distance
+    embedding = np.concatenate([np.sqrt(colour / max(colour.sum(), 1)), 0.5 * np.sqrt(texture / max(texture.sum(), 1))])
+    return dhash, embedding / np.linalg.norm(embedding)
+
+
+def _features_or_none(path: str) -> Optional[Features]:
+    try:
+        return image_features(path)
+    except OSError:
+        return None
+
+
+def hamming_distances(hashes: np.ndarray, others: np.ndarray) -> np.ndarray:
+    """
+    Bits that differ between each of `hashes` and each of `others` (both uint64 arrays), as a len(hashes) x
+    len(others) matrix.
+    """
+    xor = np.ascontiguousarray(hashes[:, None] ^ others[None, :])
+    return POPCOUNT[xor.view(np.uint8)].reshape(*xor.shape, 8).sum(axis=-1, dtype=np.uint8)
+
+
+class SimilarityIndex:
+    """
+    Visual features of every image in a library, as contiguous arrays (a row per image) so that nearest neighbour and
+    duplicate queries are a few matrix operations, for any number of query images at once.
+    """
+
+    def __init__(self, image_data: List[Dict], features: Dict[str, Features]):
+        images = [image for image in image_data if image["hash"] in features]
+        self.records = {image["id"]: image for image in images}
+        self.ids = [image["id"] for image in images]
+        self.positions = {id_: i for i, id_ in enumerate(self.ids)}
+        self.hashes = np.array([features[image["hash"]][0] for image in images], dtype=np.uint64)
+        self.embeddings = np.ascontiguousarray(np.stack([features[image["hash"]][1] for image in images])
+                                               if images else np.empty((0, EMBEDDING_SIZE)), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def nearest(self, ids: Sequence[str], k: int) -> List[List[Dict]]:
+        """
+        The `k` images most similar to each of the images with the given ids (excluding that image), most similar
+        first. Images that aren't in the index have none.
+        """
+        results = [[] for _ in ids]
+        queries = [(j, self.positions[id_]) for j, id_ in enumerate(ids) if id_ in self.positions]
+        k = min(k, len(self) - 1)
+        if k <= 0 or not queries:
+            return results
+        positions = np.array([position for _, position in queries], dtype=np.intp)
+        similarity = self.embeddings[positions] @ self.embeddings.T
+        similarity[np.arange(len(positions)), positions] = -np.inf
+        top = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+        top = np.take_along_axis(top, np.argsort(-np.take_along_axis(similarity, top, axis=1), axis=1), axis=1)
+        for (j, _), row in zip(queries, top):
+            results[j] = [self.records[self.ids[i]] for i in row]
+        return results
+
+    def duplicates(self, features: Sequence[Features]) -> List[List[Dict]]:
+        """
+        The images in the index that look like duplicates of each of the given (dhash, embedding) features.
+        """
+        if not features or not len(self):
+            return [[] for _ in features]
+        matches = look_alike(*feature_arrays(features), self.hashes, self.embeddings)
+        return [[self.records[self.ids[i]] for i in np.flatnonzero(row)] for row in matches]
+
+
+def feature_arrays(features: Sequence[Features]) -> Tuple[np.ndarray, np.ndarray]:
+    return (np.array([dhash for dhash, _ in features], dtype=np.uint64),
+            np.stack([embedding for _, embedding in features]).astype(np.float32))
+
+
+def look_alike(hashes: np.ndarray, embeddings: np.ndarray, other_hashes: np.ndarray, other_embeddings: np.ndarray) -> np.ndarray:
+    """
+    Whether each of one set of images looks like a duplicate of each of another, from their feature arrays.
+    """
+    return ((hamming_distances(hashes, other_hashes) <= DUPLICATE_HASH_DISTANCE)
+            & (embeddings @ other_embeddings.T >= DUPLICATE_SIMILARITY))
+
+
+def encode_features(features: Features) -> Tuple[bytes, bytes]:
+    dhash, embedding = features
+    return dhash.to_bytes(8, "big"), embedding.astype(np.float32).tobytes()
+
+
+def decode_features(dhash: bytes, embedding: bytes) -> Features:
+    return int.from_bytes(dhash, "big"), np.frombuffer(embedding, dtype=np.float32)
+
+
+def build_index(image_data: List[Dict], max_workers: Optional[int] = None) -> SimilarityIndex:
+    """
+    Similarity index of the images in `image_data` (from get_image_data or manifest.records). Features are stored in
+    the manifest by content hash, so only images that are new or changed are read, on a process pool.
+    """
+    hashes = list({image["hash"] for image in image_data})
+    features = {hash_: decode_features(*row) for hash_, row in manifest.features(hashes).items()}
+
+    missing = {image["hash"]: str(image["path"]) for image in image_data if image["hash"] not in features}
+    if missing:
+        workers = min(max_workers or os.cpu_count() or 1, len(missing))
+        # Spawned rather than forked, since the streamlit server process has threads of its own
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            computed = dict(zip(missing, executor.map(_features_or_none, missing.values(), chunksize=32)))
+        computed = {hash_: result for hash_, result in computed.items() if result is not None}
+        manifest.record_features([(hash_, *encode_features(result)) for hash_, result in computed.items()])
+        features.update(computed)
+
+    return SimilarityIndex(image_data, features)
@@ -0,0 +1,130 @@
+"""
+Headless client for a running streamlit server, speaking its websocket protocol the way a browser tab does, so that
+pages can be run against the server itself: by warm_up.py, to fill the server's caches, and by benchmarks/load.py.
+
+The protocol is streamlit's own protobuf messages, which aren't a stable public API, so check_version() refuses
+streamlit versions the client wasn't written for, or whose messages lack the fields it uses.
+"""
+import sys
+import time
+from typing import Optional
+
+import streamlit
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from tornado.httpclient import HTTPRequest
+from tornado.websocket import websocket_connect
+
+# Versions the client has been run against. Older ones are refused; newer ones are tried, with a warning.
+MIN_VERSION = (1, 28)
+MAX_TESTED_VERSION = (1, 56)
+
+# Message fields the client relies on
+FORWARD_TYPES = ["new_session", "delta", "script_finished"]
+RERUN_FIELDS = ["query_string", "widget_states", "page_script_hash"]
+
+WIDGET_TYPES = ("button", "text_input", "number_input", "checkbox", "selectbox")
+
+
+class UnsupportedStreamlitError(RuntimeError):
+    pass
+
+
+def streamlit_version() -> tuple:
+    return tuple(int(part) for part in streamlit.__version__.split(".")[:2] if part.isdigit())
+
+
+def check_version():
+    version = streamlit_version()
+    if version < MIN_VERSION or version[0] != MIN_VERSION[0]:
+        raise UnsupportedStreamlitError(f"streamlit {streamlit.__version__} isn't supported (needs {'.'.join(map(str, MIN_VERSION))} or later 1.x)")
+    forward_types = {field.name for field in ForwardMsg.DESCRIPTOR.oneofs_by_name["type"].fields}
+    rerun_fields = BackMsg.DESCRIPTOR.fields_by_name["rerun_script"].message_type.fields_by_name
+    missing = [name for name in FORWARD_TYPES if name not in forward_types] + [name for name in RERUN_FIELDS if name not in rerun_fields]
+    if missing:
+        raise UnsupportedStreamlitError(f"streamlit {streamlit.__version__}'s protocol has no {', '.join(missing)}")
+    if version > MAX_TESTED_VERSION:
+        print(f"Warning: streamlit_client hasn't been tested with streamlit {streamlit.__version__}", file=sys.stderr)
+
+
+class Session:
+    """
+    One headless browser tab. Keeps the widgets of the latest run by label, so that callers can fill in and click them,
+    and the values it has set, which (like a browser) it sends with every rerun.
+    """
+
+    def __init__(self, url: str):
+        check_version()
+        self.url = url
+        self.ws = None
+        self.pages = {}  # Page name -> script hash
+        self.page = ""
+        self.widgets = {}  # (element type, label) -> widget id
+        self.values = {}  # Widget id -> WidgetState to send with every rerun
+        self.timings = []  # (step, seconds)
+        self.errors = 0
+        self.finished = None  # How the current run ended, once it has
+
+    async def connect(self):
+        request = HTTPRequest(self.url.replace("http", "ws", 1) + "/_stcore/stream")
+        self.ws = await websocket_connect(request, subprotocols=["streamlit"], max_message_size=256 * 1024 * 1024)
+
+    def close(self):
+        if self.ws is not None:
+            self.ws.close()
+
+    def set_value(self, kind: str, label: str, **value):
+        widget_id = self.widgets[(kind, label)]
+        self.values[widget_id] = WidgetState(id=widget_id, **value)
+
+    async def rerun(self, step: str, page: Optional[str] = None, click: Optional[str] = None):
+        """
+        Rerun the current page (or switch to `page`), optionally clicking the button labelled `click`, and wait for the
+        script to finish.
+        """
+        if page is not None:
+            self.page = self.pages.get(page, "")
+            self.values = {}
+        states = list(self.values.values())
+        if click is not None:
+            states.append(WidgetState(id=self.widgets[("button", click)], trigger_value=True))
+        message = BackMsg()
+        message.rerun_script.query_string = ""
+        message.rerun_script.page_script_hash = self.page
+        message.rerun_script.widget_states.widgets.extend(states)
+
+        self.widgets = {}
+        self.finished = None
+        started = time.perf_counter()
+        await self.ws.write_message(message.SerializeToString(), binary=True)
+        while True:
+            data = await self.ws.read_message()
+            if data is None:
+                raise ConnectionError("Server closed the connection")
+            self.handle(ForwardMsg.FromString(data))
+            if self.finished is not None:
+                if self.finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:  # Scripts calling st.rerun() go round again
+                    break
+                self.finished = None
+        self.timings.append((step, time.perf_counter() - started))
+
+    def handle(self, msg: ForwardMsg):
+        kind = msg.WhichOneof("type")
+        if kind == "new_session":
+            self.finished = None
+            self.pages.update({page.page_name: page.page_script_hash for page in msg.new_session.app_pages})
+        elif kind == "navigation":  # Newer versions send the pages separately
+            self.pages.update({page.page_name: page.page_script_hash for page in msg.navigation.app_pages})
+        elif kind == "script_finished":
+            self.finished = msg.script_finished
+            if msg.script_finished == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                self.errors += 1
+        elif kind == "delta" and msg.delta.WhichOneof("type") == "new_element":
+            element = msg.delta.new_element
+            element_type = element.WhichOneof("type")
+            if element_type == "exception":
+                self.errors += 1
+            elif element_type in WIDGET_TYPES:
+                widget = getattr(element, element_type)
+                self.widgets[(element_type, widget.label)] = widget.id
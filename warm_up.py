@@ -0,0 +1,125 @@
+"""
+Fill the app's caches before it takes traffic, so that the first users after a deploy don't wait for them:
+
+    python warm_up.py                                  # before starting the server
+    streamlit run Home.py &
+    python warm_up.py --url http://localhost:8501      # once it's listening, e.g. as a readiness gate
+
+First brings the manifest up to date with the image directory, computes the visual features of new images and builds
+any missing renditions. These are all kept on disk (.cache and static/renditions), so replicas that share them start
+warm, and this part is quick when there's nothing new. With --url it then waits for the server to be healthy and runs
+each page once in a headless browser tab (streamlit_client), which loads the image, search and similarity indexes into
+the server's process. It exits non-zero if a page fails, or if streamlit_client doesn't support the installed streamlit.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import manifest
+from images import RENDITION_WIDTHS, build_rendition, rendition_path
+from similarity import build_index
+from streamlit_client import Session, UnsupportedStreamlitError, check_version
+
+# Pages run by --url, in order. Multichoice is last so that hard mode can be switched on there afterwards.
+PAGES = ["Home", "Catalogue", "Spelling", "Guess", "Multichoice"]
+
+
+def _build_rendition(job: Tuple[str, str, int]):
+    source, target, width = job
+    try:
+        build_rendition(Path(source), Path(target), width)
+        return None
+    except OSError as e:
+        return e
+
+
+def warm_disk(directory: str = "images", renditions: Optional[List[str]] = None, max_workers: Optional[int] = None):
+    started = time.perf_counter()
+    changed = manifest.rescan(directory)
+    images = manifest.records(directory)
+    print(f"Manifest: {len(images)} images, {changed} changed ({time.perf_counter() - started:.1f}s)")
+
+    started = time.perf_counter()
+    index = build_index(images, max_workers)
+    print(f"Similarity features: {len(index)} images ({time.perf_counter() - started:.1f}s)")
+
+    started = time.perf_counter()
+    jobs = [(image, rendition) for image in images for rendition in renditions or RENDITION_WIDTHS
+            if not rendition_path(image, rendition).exists()]
+    if jobs:
+        workers = min(max_workers or os.cpu_count() or 1, len(jobs))
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            results = executor.map(_build_rendition, [(str(image["path"]), str(rendition_path(image, rendition)), RENDITION_WIDTHS[rendition])
+                                                      for image, rendition in jobs], chunksize=16)
+            for (image, rendition), error in zip(jobs, results):
+                if error is not None:
+                    print(f"  Couldn't build {rendition} rendition of {image['path']}: {error}")
+                else:
+                    manifest.record_derivative(image["path"], rendition, rendition_path(image, rendition))
+    print(f"Renditions: {len(jobs)} built ({time.perf_counter() - started:.1f}s)")
+
+
+def wait_until_healthy(url: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            urllib.request.urlopen(f"{url}/_stcore/health", timeout=2)
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                sys.exit(f"{url} wasn't healthy within {timeout:.0f}s")
+            time.sleep(0.5)
+
+
+async def warm_server(url: str) -> int:
+    """
+    Run every page once, and start a round of Multichoice in hard mode, in one session. Returns the number of pages
+    that failed.
+    """
+    session = Session(url)
+    await session.connect()
+    try:
+        for page in PAGES:
+            await session.rerun(page, page=page)
+        session.set_value("checkbox", "Hard mode", bool_value=True)
+        await session.rerun("Multichoice (hard mode)")
+        await session.rerun("Multichoice (hard mode round)", click="Start")  # The similarity index is loaded by a round
+    finally:
+        session.close()
+    for step, seconds in session.timings:
+        print(f"  {step}: {seconds:.2f}s")
+    return session.errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--directory", default="images")
+    parser.add_argument("--renditions", help=f"Comma separated renditions to build (default: all of {', '.join(RENDITION_WIDTHS)})")
+    parser.add_argument("--workers", type=int, help="Processes to compute features and build renditions on (default: one per CPU)")
+    parser.add_argument("--url", help="Also warm the server at this URL, once it's healthy")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds to wait for the server to be healthy")
+    args = parser.parse_args()
+
+    if args.url:
+        try:
+            check_version()  # Before spending time on the disk caches
+        except UnsupportedStreamlitError as e:
+            sys.exit(f"Can't warm the server: {e}")
+    warm_disk(args.directory, args.renditions.split(",") if args.renditions else None, args.workers)
+    if args.url:
+        url = args.url.rstrip("/")
+        wait_until_healthy(url, args.timeout)
+        print(f"Warming {url}...")
+        if errors := asyncio.run(warm_server(url)):
+            sys.exit(f"{errors} pages failed")
+
+
+if __name__ == "__main__":
+    main()